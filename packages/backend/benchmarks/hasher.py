@@ -0,0 +1,94 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""Benchmark the bulk hashing path of Hasher against per-item hashing.
+
+Usage: uv run python benchmarks/hasher.py [--count N]
+"""
+
+import argparse
+import hashlib
+import json
+import time
+
+import numpy as np
+import pyarrow as pa
+
+from embedding_atlas.utils import Hasher, xxhash
+
+
+class PerItemHasher:
+    """The previous Hasher, which walks lists one item at a time."""
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def _emit(self, type: bytes, data: bytes):
+        self.hash.update(type + b"{")
+        self.hash.update(data)
+        self.hash.update(b"}")
+
+    def update(self, value):
+        if isinstance(value, bytes):
+            self._emit(b"bytes", value)
+        elif isinstance(value, str):
+            self._emit(b"str", value.encode("utf-8"))
+        elif isinstance(value, np.ndarray):
+            self._emit(b"np.ndarray", value.tobytes())
+        elif isinstance(value, list):
+            self.hash.update(b"list{")
+            for item in value:
+                self.update(item)
+            self.hash.update(b"}")
+        elif isinstance(value, dict):
+            self.hash.update(b"dict{")
+            for key, item in value.items():
+                self.update(key)
+                self.update(item)
+            self.hash.update(b"}")
+        else:
+            self._emit(b"json", json.dumps(value, sort_keys=True).encode("utf-8"))
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def measure(hasher_class, value) -> float:
+    t0 = time.perf_counter()
+    hasher = hasher_class()
+    hasher.update(value)
+    hasher.hexdigest()
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    count = args.count
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing"]
+    texts = [
+        " ".join(rng.choice(words, size=rng.integers(5, 40))) for _ in range(count)
+    ]
+    images = [{"bytes": rng.bytes(2048), "path": None} for _ in range(count // 20)]
+    vectors = rng.standard_normal((count // 4, 384), dtype=np.float32)
+
+    print(f"xxhash: {'available' if xxhash is not None else 'not installed'}")
+    text_array = pa.array(texts, type=pa.large_string())
+    # (name, input for the per-item hasher, input for the bulk hasher)
+    for name, value, bulk_value in [
+        (f"{len(texts)} texts", texts, texts),
+        (f"{len(texts)} texts (Arrow)", texts, text_array),
+        (f"{len(images)} image dicts", images, images),
+        (f"{vectors.shape} ndarray", vectors, vectors),
+    ]:
+        before = measure(PerItemHasher, value)
+        after = measure(Hasher, bulk_value)
+        print(
+            f"{name:>28}: per-item {before:7.3f}s, bulk {after:7.3f}s, speedup {before / after:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
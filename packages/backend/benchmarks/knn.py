@@ -0,0 +1,55 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""Benchmark the kNN engines for recall and latency.
+
+Recall is measured against the exact engine. The NN-descent timing includes
+JIT compilation on the first run, so it is reported for a cold and a warm run.
+
+Usage: uv run python benchmarks/knn.py [--count N] [--dim D] [--vectors path.npy]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from embedding_atlas.knn import exact_nearest_neighbors, nndescent_nearest_neighbors
+
+
+def recall(indices: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(a, b)) for a, b in zip(indices, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=50_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--n-neighbors", type=int, default=15)
+    parser.add_argument("--metric", default="cosine")
+    parser.add_argument("--vectors", help="a .npy file with the vectors to use")
+    args = parser.parse_args()
+
+    if args.vectors is not None:
+        vectors = np.load(args.vectors, mmap_mode="r")
+    else:
+        # Clustered data, closer to real embeddings than uniform noise.
+        rng = np.random.default_rng(42)
+        centers = rng.standard_normal((100, args.dim), dtype=np.float32)
+        vectors = centers[rng.integers(0, 100, size=args.count)]
+        vectors += 0.5 * rng.standard_normal(vectors.shape, dtype=np.float32)
+    print(f"{vectors.shape} vectors, {args.n_neighbors} neighbors, {args.metric}")
+
+    t0 = time.perf_counter()
+    truth, _ = exact_nearest_neighbors(vectors, args.n_neighbors, args.metric)
+    print(f"{'exact':>18}: {time.perf_counter() - t0:7.2f}s, recall 1.000")
+
+    for name in ["nndescent (cold)", "nndescent (warm)"]:
+        t0 = time.perf_counter()
+        indices, _ = nndescent_nearest_neighbors(vectors, args.n_neighbors, args.metric)
+        elapsed = time.perf_counter() - t0
+        print(f"{name:>18}: {elapsed:7.2f}s, recall {recall(indices, truth):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""Benchmark the PCA pre-reduction: kNN time with and without it, and the
+recall of the neighbors found on the reduced vectors.
+
+Usage: uv run python benchmarks/pca.py [--count N] [--dim D] [--pca-dims K] [--vectors path.npy]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from embedding_atlas.knn import exact_nearest_neighbors
+from embedding_atlas.pca import randomized_pca
+
+
+def recall(indices: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(a, b)) for a, b in zip(indices, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--pca-dims", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--n-neighbors", type=int, default=15)
+    parser.add_argument("--vectors", help="a .npy file with the vectors to use")
+    args = parser.parse_args()
+
+    if args.vectors is not None:
+        vectors = np.load(args.vectors, mmap_mode="r")
+    else:
+        # Embeddings have most of their variance in a few hundred directions.
+        rng = np.random.default_rng(42)
+        latent = rng.standard_normal((args.count, 256), dtype=np.float32)
+        latent *= np.exp(-np.arange(256) / 64, dtype=np.float32)
+        mixing = rng.standard_normal((256, args.dim), dtype=np.float32)
+        vectors = latent @ mixing
+        vectors += 0.05 * rng.standard_normal(vectors.shape, dtype=np.float32)
+    print(f"{vectors.shape} vectors, {args.n_neighbors} neighbors")
+
+    t0 = time.perf_counter()
+    truth, _ = exact_nearest_neighbors(vectors, args.n_neighbors)
+    baseline = time.perf_counter() - t0
+    print(f"{'no reduction':>14}: kNN {baseline:7.2f}s")
+
+    for pca_dims in args.pca_dims:
+        t0 = time.perf_counter()
+        reduced = randomized_pca(vectors, pca_dims)
+        t1 = time.perf_counter()
+        indices, _ = exact_nearest_neighbors(reduced, args.n_neighbors)
+        t2 = time.perf_counter()
+        print(
+            f"{f'{pca_dims} dims':>14}: PCA {t1 - t0:7.2f}s, kNN {t2 - t1:7.2f}s, "
+            f"speedup {baseline / (t2 - t0):5.2f}x, recall {recall(indices, truth):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
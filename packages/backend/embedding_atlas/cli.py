@@ -6,7 +6,9 @@ import asyncio
 import logging
 import pathlib
 import socket
+import threading
 from pathlib import Path
+from typing import Callable
 
 import click
 import inquirer
@@ -14,9 +16,16 @@ import numpy as np
 import pandas as pd
 import uvicorn
 
-from .data_source import DataSource
+from .data_source import NEIGHBORS_SIDECAR, DataSource, load_exported_dataset
+from .neighbors import NeighborGraph
 from .server import make_server
-from .utils import Hasher, load_huggingface_data, load_pandas_data
+from .utils import (
+    Hasher,
+    cache_path,
+    file_fingerprint,
+    load_huggingface_data,
+    load_pandas_data,
+)
 from .version import __version__
 
 
@@ -50,7 +59,9 @@ def determine_and_load_data(filename: str, splits: list[str] | None = None):
 
 
 def load_datasets(
-    inputs: list[str], splits: list[str] | None = None, sample: int | None = None
+    inputs: list[str],
+    splits: list[str] | None = None,
+    sample: int | None = None,
 ) -> pd.DataFrame:
     existing_column_names = set()
     dataframes = []
@@ -99,6 +110,45 @@ def find_available_port(start_port: int, max_attempts: int = 10, host="localhost
     raise RuntimeError("No available ports found in the given range")
 
 
+class _StatusHandler(logging.Handler):
+    """Records the last log message of the current thread in a status dict."""
+
+    def __init__(self, status: dict):
+        super().__init__()
+        self.status = status
+        self.thread_id = threading.get_ident()
+
+    def emit(self, record: logging.LogRecord):
+        if record.thread == self.thread_id:
+            self.status["message"] = record.getMessage()
+
+
+def refine_projection_in_background(
+    dataset: DataSource, compute: Callable[[], dict]
+):
+    """Runs `compute` on a background thread, and replaces the dataset columns
+    with the ones it returns. The progress is reported in the dataset's
+    projection status."""
+    status = {"state": "running", "message": None, "error": None}
+    dataset.projection_status = status
+
+    def run():
+        handler = _StatusHandler(status)
+        logging.getLogger().addHandler(handler)
+        try:
+            dataset.update_columns(compute())
+            status["state"] = "done"
+            logging.info("Projection finished, reload the page to see it")
+        except Exception as e:
+            logging.exception("Failed to compute the projection")
+            status["state"] = "failed"
+            status["error"] = str(e)
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
 @click.command()
 @click.argument("inputs", nargs=-1, required=True)
 @click.option("--text", default=None, help="Column containing text data.")
@@ -106,6 +156,11 @@ def find_available_port(start_port: int, max_attempts: int = 10, host="localhost
 @click.option(
     "--vector", default=None, help="Column containing pre-computed vector embeddings."
 )
+@click.option(
+    "--vector-file",
+    default=None,
+    help="A .npy file with pre-computed vector embeddings, one row per data row in the order of the inputs. The file is memory-mapped and used for the projection, instead of a --vector column.",
+)
 @click.option(
     "--split",
     default=[],
@@ -135,6 +190,59 @@ def find_available_port(start_port: int, max_attempts: int = 10, host="localhost
     default=None,
     help="Batch size for processing embeddings (default: 32 for text, 16 for images). Larger values use more memory but may be faster.",
 )
+@click.option(
+    "--max-tokens-per-batch",
+    type=int,
+    default=None,
+    help="Size text embedding batches by a token budget instead of --batch-size: texts are grouped by length, and each batch has at most this many tokens including padding.",
+)
+@click.option(
+    "--embedding-workers",
+    type=int,
+    default=None,
+    help="Number of CPU worker processes for text embedding. Each worker loads its own copy of the model and uses an equal share of the CPU cores.",
+)
+@click.option(
+    "--embedding-backend",
+    type=click.Choice(["torch", "onnx", "onnx-int8"]),
+    default="torch",
+    help="Inference backend for the embedding model (default: 'torch'). 'onnx' and 'onnx-int8' run an exported (and for 'onnx-int8', int8-quantized) model with ONNX Runtime, which is faster on CPUs. Requires optimum[onnxruntime].",
+)
+@click.option(
+    "--knn-engine",
+    type=click.Choice(["auto", "exact", "nndescent"]),
+    default="auto",
+    help="Engine for the k-nearest-neighbor graph (default: 'auto'). 'exact' is a blocked brute-force search, 'nndescent' is the approximate search used by UMAP. 'auto' uses 'exact' for up to 50,000 rows with the cosine or euclidean metric, and 'nndescent' otherwise.",
+)
+@click.option(
+    "--projection-fit-sample",
+    type=int,
+    default=None,
+    help="Fit UMAP on a random sample of this many rows, and place the other rows with UMAP's transform in chunks. Use this for very large datasets, where fitting on all rows takes too long or runs out of memory.",
+)
+@click.option(
+    "--projection-workers",
+    type=int,
+    default=None,
+    help="Number of processes to place the rows outside the fit sample on (with --projection-fit-sample).",
+)
+@click.option(
+    "--pca-dims",
+    type=int,
+    default=None,
+    help="Reduce the embeddings to this many dimensions with randomized PCA before computing nearest neighbors and UMAP (e.g., 128). Speeds up the projection of high-dimensional embeddings.",
+)
+@click.option(
+    "--progressive",
+    is_flag=True,
+    default=False,
+    help="Start the server right away with a quick preview layout, and compute the projection in the background. When it finishes, the projection replaces the preview in the served data (reload the page to see it). Progress is reported at /data/projection/status.",
+)
+@click.option(
+    "--append-to",
+    default=None,
+    help="An existing dataset with a projection (e.g., the dataset.parquet of an exported application). The inputs are appended to it and placed into its existing layout with the same settings, without recomputing the layout. Use the same --text/--image/--vector, --model, and UMAP options as for the existing projection.",
+)
 @click.option(
     "--x",
     "x_column",
@@ -150,6 +258,11 @@ def find_available_port(start_port: int, max_attempts: int = 10, host="localhost
     "neighbors_column",
     help='Column containing pre-computed nearest neighbors in format: {"ids": [n1, n2, ...], "distances": [d1, d2, ...]}. IDs should be zero-based row indices.',
 )
+@click.option(
+    "--neighbors-sidecar/--no-neighbors-sidecar",
+    default=True,
+    help="Keep the nearest neighbors out of the served dataset, in a separate compact file that the viewer fetches on demand (default: enabled).",
+)
 @click.option(
     "--sample",
     default=None,
@@ -174,12 +287,35 @@ def find_available_port(start_port: int, max_attempts: int = 10, host="localhost
 @click.option(
     "--umap-random-state", type=int, help="Random seed for reproducible UMAP results."
 )
+@click.option(
+    "--cache-key",
+    "cache_key_mode",
+    type=click.Choice(["content", "fingerprint"]),
+    default="content",
+    help="How cached projections are identified: 'content' (default) hashes the input data, 'fingerprint' uses the path, size, modification time and parquet metadata of the input files, which skips hashing the data when the projection is cached.",
+)
 @click.option(
     "--duckdb",
     type=str,
     default="wasm",
     help="DuckDB connection mode: 'wasm' (run in browser), 'server' (run on this server), or URI (e.g., 'ws://localhost:3000').",
 )
+@click.option(
+    "--duckdb-persist/--no-duckdb-persist",
+    default=False,
+    help="With '--duckdb server', keep the dataset in a database file in the cache directory, which is reopened on restart instead of being built again.",
+)
+@click.option(
+    "--query-cache-size",
+    type=int,
+    default=256,
+    help="With '--duckdb server', the memory budget in MB of the cache of query results (default: 256, 0 disables the cache).",
+)
+@click.option(
+    "--query-cache-persist/--no-query-cache-persist",
+    default=False,
+    help="With '--duckdb server', also keep query results in the cache directory, so they are reused after a restart.",
+)
 @click.option(
     "--host",
     default="localhost",
@@ -214,21 +350,36 @@ def main(
     text: str | None,
     image: str | None,
     vector: str | None,
+    vector_file: str | None,
     split: list[str] | None,
     enable_projection: bool,
     model: str | None,
     trust_remote_code: bool,
     batch_size: int | None,
+    max_tokens_per_batch: int | None,
+    embedding_workers: int | None,
+    embedding_backend: str,
+    knn_engine: str,
+    projection_fit_sample: int | None,
+    projection_workers: int | None,
+    pca_dims: int | None,
+    progressive: bool,
+    append_to: str | None,
     x_column: str | None,
     y_column: str | None,
     neighbors_column: str | None,
+    neighbors_sidecar: bool,
     sample: int | None,
     umap_n_neighbors: int | None,
     umap_min_dist: int | None,
     umap_metric: str | None,
     umap_random_state: int | None,
+    cache_key_mode: str,
     static: str | None,
     duckdb: str,
+    duckdb_persist: bool,
+    query_cache_size: int,
+    query_cache_persist: bool,
     host: str,
     port: int,
     enable_auto_port: bool,
@@ -240,33 +391,195 @@ def main(
         format="%(levelname)s: (%(name)s) %(message)s",
     )
 
+    umap_args = {}
+    if umap_min_dist is not None:
+        umap_args["min_dist"] = umap_min_dist
+    if umap_n_neighbors is not None:
+        umap_args["n_neighbors"] = umap_n_neighbors
+    if umap_random_state is not None:
+        umap_args["random_state"] = umap_random_state
+    if umap_metric is not None:
+        umap_args["metric"] = umap_metric
+
+    if duckdb_persist and duckdb != "server":
+        raise click.UsageError("--duckdb-persist requires --duckdb server")
+    if query_cache_persist and (duckdb != "server" or query_cache_size <= 0):
+        raise click.UsageError(
+            "--query-cache-persist requires --duckdb server and a query cache"
+        )
+
+    compute_projection = (
+        enable_projection
+        and append_to is None
+        and (x_column is None or y_column is None)
+    )
+
+    fingerprints = None
+    if compute_projection and cache_key_mode == "fingerprint":
+        fingerprints = [file_fingerprint(fn) for fn in inputs]
+        if any(f is None for f in fingerprints):
+            logging.info(
+                "Not all inputs are local files, using content hashing for the projection cache"
+            )
+            fingerprints = None
+
+    def projection_cache_key():
+        if fingerprints is None:
+            return None
+        hasher = Hasher()
+        hasher.update(
+            {
+                "version": 1,
+                "inputs": fingerprints,
+                "split": list(split or []),
+                "sample": sample,
+                "text": text,
+                "image": image,
+                "vector": vector,
+                "vector_file": (
+                    None if vector_file is None else file_fingerprint(vector_file)
+                ),
+                "model": model,
+                "embedding_backend": embedding_backend,
+                "umap_args": umap_args,
+                "knn_engine": knn_engine,
+                "projection_fit_sample": projection_fit_sample,
+                "pca_dims": pca_dims,
+            }
+        )
+        return hasher.hexdigest()
+
+    projection_cached = False
+    if fingerprints is not None:
+        from .projection import projection_cache_exists
+
+        projection_cached = projection_cache_exists(projection_cache_key())  # type: ignore
+
     df = load_datasets(inputs, splits=split, sample=sample)
 
+    vectors = None
+    if vector_file is not None:
+        if vector is not None:
+            raise click.UsageError("--vector-file cannot be used with --vector")
+        if sample is not None:
+            raise click.UsageError(
+                "--vector-file cannot be used with --sample, the rows would not align"
+            )
+        if append_to is not None:
+            raise click.UsageError("--append-to does not support --vector-file")
+
+        from .projection import load_vector_file
+
+        vectors = load_vector_file(vector_file)
+        if len(vectors) != len(df):
+            raise click.UsageError(
+                f"--vector-file has {len(vectors)} rows, but the inputs have {len(df)}"
+            )
+
+    if append_to is not None:
+        if pca_dims is not None:
+            raise click.UsageError("--append-to does not support --pca-dims")
+
+        from .projection import (
+            append_image_projection,
+            append_text_projection,
+            append_vector_projection,
+        )
+
+        existing = load_exported_dataset(append_to)
+        if "_row_index" in existing.columns:
+            # Exported files have their rows in spatial order, while neighbor
+            # ids (and the rows of the sidecar) follow the original order.
+            existing = existing.sort_values("_row_index", kind="stable")
+            existing = existing.reset_index(drop=True)
+            if not np.array_equal(existing["_row_index"], np.arange(len(existing))):
+                raise click.UsageError(
+                    f"{append_to} does not have the row ids of an export (_row_index)"
+                )
+        # Row ids are assigned again below.
+        existing = existing.drop(columns=["_row_index"], errors="ignore")
+        x_column = x_column or "projection_x"
+        y_column = y_column or "projection_y"
+        neighbors_column = neighbors_column or "__neighbors"
+        sidecar = Path(append_to).with_name(NEIGHBORS_SIDECAR)
+        if neighbors_column not in existing.columns and sidecar.is_file():
+            # Exported with the neighbors in a separate file.
+            graph = NeighborGraph.from_bytes(sidecar.read_bytes())
+            if len(graph) != len(existing):
+                raise click.UsageError(
+                    f"{sidecar} has {len(graph)} rows, but {append_to} has {len(existing)}"
+                )
+            existing[neighbors_column] = graph.to_column()
+        if vector is not None:
+            df = append_vector_projection(
+                existing,
+                df,
+                vector,
+                x=x_column,
+                y=y_column,
+                neighbors=neighbors_column,
+                umap_args=umap_args,
+            )
+        elif text is not None:
+            df = append_text_projection(
+                existing,
+                df,
+                text,
+                x=x_column,
+                y=y_column,
+                neighbors=neighbors_column,
+                model=model,
+                trust_remote_code=trust_remote_code,
+                batch_size=batch_size,
+                max_tokens_per_batch=max_tokens_per_batch,
+                embedding_workers=embedding_workers,
+                embedding_backend=embedding_backend,  # type: ignore
+                umap_args=umap_args,
+            )
+        elif image is not None:
+            df = append_image_projection(
+                existing,
+                df,
+                image,
+                x=x_column,
+                y=y_column,
+                neighbors=neighbors_column,
+                model=model,
+                trust_remote_code=trust_remote_code,
+                batch_size=batch_size,
+                embedding_backend=embedding_backend,  # type: ignore
+                umap_args=umap_args,
+            )
+        else:
+            raise click.UsageError("--append-to requires --text, --image, or --vector")
+
     print(df)
 
-    if enable_projection and (x_column is None or y_column is None):
+    background_projection = None
+    if compute_projection:
         # No x, y column selected, first see if text/image/vectors column is specified, if not, ask for it
-        if text is None and image is None and vector is None:
+        if text is None and image is None and vector is None and vectors is None:
             text = prompt_for_column(
                 df, "Select a column you want to run the embedding on"
             )
-        umap_args = {}
-        if umap_min_dist is not None:
-            umap_args["min_dist"] = umap_min_dist
-        if umap_n_neighbors is not None:
-            umap_args["n_neighbors"] = umap_n_neighbors
-        if umap_random_state is not None:
-            umap_args["random_state"] = umap_random_state
-        if umap_metric is not None:
-            umap_args["metric"] = umap_metric
         # Run embedding and projection
-        if text is not None or image is not None or vector is not None:
+        if (
+            text is not None
+            or image is not None
+            or vector is not None
+            or vectors is not None
+        ):
             from .projection import (
                 compute_image_projection,
                 compute_text_projection,
                 compute_vector_projection,
             )
 
+            # A cached projection loads right away, without a preview.
+            progressive = (
+                progressive and export_application is None and not projection_cached
+            )
+
             x_column = find_column_name(df.columns, "projection_x")
             y_column = find_column_name(df.columns, "projection_y")
             if neighbors_column is None:
@@ -275,41 +588,85 @@ def main(
             else:
                 # If neighbors_column is already specified, don't overwrite it.
                 new_neighbors_column = None
-            if vector is not None:
-                compute_vector_projection(
-                    df,
-                    vector,
-                    x=x_column,
-                    y=y_column,
-                    neighbors=new_neighbors_column,
-                    umap_args=umap_args,
-                )
-            elif text is not None:
-                compute_text_projection(
-                    df,
-                    text,
-                    x=x_column,
-                    y=y_column,
-                    neighbors=new_neighbors_column,
-                    model=model,
-                    trust_remote_code=trust_remote_code,
-                    batch_size=batch_size,
-                    umap_args=umap_args,
+
+            def run_projection(frame: pd.DataFrame):
+                if vector is not None or vectors is not None:
+                    compute_vector_projection(
+                        frame,
+                        vector,
+                        x=x_column,
+                        y=y_column,
+                        neighbors=new_neighbors_column,
+                        umap_args=umap_args,
+                        knn_engine=knn_engine,  # type: ignore
+                        projection_fit_sample=projection_fit_sample,
+                        projection_workers=projection_workers,
+                        pca_dims=pca_dims,
+                        cache_key=projection_cache_key(),
+                        vectors=vectors,
+                    )
+                elif text is not None:
+                    compute_text_projection(
+                        frame,
+                        text,
+                        x=x_column,
+                        y=y_column,
+                        neighbors=new_neighbors_column,
+                        model=model,
+                        trust_remote_code=trust_remote_code,
+                        batch_size=batch_size,
+                        max_tokens_per_batch=max_tokens_per_batch,
+                        embedding_workers=embedding_workers,
+                        embedding_backend=embedding_backend,  # type: ignore
+                        umap_args=umap_args,
+                        knn_engine=knn_engine,  # type: ignore
+                        projection_fit_sample=projection_fit_sample,
+                        projection_workers=projection_workers,
+                        pca_dims=pca_dims,
+                        cache_key=projection_cache_key(),
+                    )
+                elif image is not None:
+                    compute_image_projection(
+                        frame,
+                        image,
+                        x=x_column,
+                        y=y_column,
+                        neighbors=new_neighbors_column,
+                        model=model,
+                        trust_remote_code=trust_remote_code,
+                        batch_size=batch_size,
+                        embedding_backend=embedding_backend,  # type: ignore
+                        umap_args=umap_args,
+                        knn_engine=knn_engine,  # type: ignore
+                        projection_fit_sample=projection_fit_sample,
+                        projection_workers=projection_workers,
+                        pca_dims=pca_dims,
+                        cache_key=projection_cache_key(),
+                    )
+                else:
+                    raise RuntimeError("unreachable")
+
+            if progressive:
+                from .projection import (
+                    compute_preview_projection,
+                    empty_neighbors_column,
                 )
-            elif image is not None:
-                compute_image_projection(
+
+                compute_preview_projection(
                     df,
-                    image,
                     x=x_column,
                     y=y_column,
-                    neighbors=new_neighbors_column,
-                    model=model,
-                    trust_remote_code=trust_remote_code,
-                    batch_size=batch_size,
-                    umap_args=umap_args,
+                    text=text,
+                    image=image,
+                    vector=vector,
+                    vectors=vectors,
                 )
+                if new_neighbors_column is not None:
+                    # No neighbors until the projection is computed.
+                    df[new_neighbors_column] = empty_neighbors_column(len(df))
+                background_projection = run_projection
             else:
-                raise RuntimeError("unreachable")
+                run_projection(df)
 
     id_column = find_column_name(df.columns, "_row_index")
     df[id_column] = range(df.shape[0])
@@ -337,7 +694,21 @@ def main(
     hasher.update(metadata)
     identifier = hasher.hexdigest()
 
-    dataset = DataSource(identifier, df, metadata)
+    dataset = DataSource(identifier, df, metadata, neighbors_sidecar=neighbors_sidecar)
+
+    if background_projection is not None:
+        input_columns = [c for c in [text, image, vector] if c is not None]
+        output_columns = [
+            c for c in [x_column, y_column, new_neighbors_column] if c is not None
+        ]
+
+        frame = df[input_columns].reset_index(drop=True)
+
+        def refine() -> dict:
+            background_projection(frame)
+            return {c: frame[c].array for c in output_columns}
+
+        refine_projection_in_background(dataset, refine)
 
     if static is None:
         static = str((pathlib.Path(__file__).parent / "static").resolve())
@@ -347,7 +718,25 @@ def main(
             f.write(dataset.make_archive(static))
         exit(0)
 
-    app = make_server(dataset, static_path=static, duckdb_uri=duckdb)
+    duckdb_path = None
+    if duckdb_persist:
+        duckdb_path = cache_path("duckdb") / f"{identifier}.duckdb"
+    query_cache_directory = None
+    if query_cache_persist:
+        query_cache_directory = cache_path("queries", identifier)
+    # The data source has the dataset, and releases it once in the database.
+    del df
+
+    app = make_server(
+        dataset,
+        static_path=static,
+        duckdb_uri=duckdb,
+        duckdb_path=duckdb_path,
+        query_cache_bytes=(
+            query_cache_size * 1024 * 1024 if duckdb == "server" else 0
+        ),
+        query_cache_directory=query_cache_directory,
+    )
 
     if enable_auto_port:
         new_port = find_available_port(port, max_attempts=10, host=host)
@@ -2,12 +2,66 @@
 
 import json
 import os
+import threading
+import weakref
 import zipfile
 from io import BytesIO
+from pathlib import Path
+from typing import Callable, Literal
 
 import pandas as pd
 
-from .utils import cache_path, to_parquet_bytes
+from .neighbors import NeighborGraph
+from .utils import cache_path, load_pandas_data, to_parquet_bytes, write_parquet
+
+# The file name of the nearest neighbor graph, next to dataset.parquet.
+NEIGHBORS_SIDECAR = "neighbors.bin"
+
+# The files of the split layout, next to dataset.parquet (see DataSource.layout).
+LAYOUT_FILES = {
+    "preview": "dataset.preview.parquet",
+    "hot": "dataset.hot.parquet",
+    "cold": "dataset.cold.parquet",
+}
+LayoutPart = Literal["preview", "hot", "cold"]
+
+# The number of rows in the preview file.
+PREVIEW_ROWS = 10_000
+
+# Text columns with at most this many distinct values are categories, and hot.
+CATEGORY_MAX_VALUES = 1000
+
+
+def load_exported_dataset(url: str) -> pd.DataFrame:
+    """Loads a dataset file, or the dataset.parquet of an exported application,
+    which is not in the export if the dataset is split (see DataSource.layout):
+    the dataset is then put together from the hot and cold files."""
+    path = Path(url)
+    metadata_path = path.with_name("metadata.json")
+    if path.name == "dataset.parquet" and not path.exists() and metadata_path.is_file():
+        layout = json.loads(metadata_path.read_text()).get("layout")
+        if layout is not None:
+            parts = [
+                pd.read_parquet(path.with_name(layout[part]["file"]))
+                for part in ("hot", "cold")
+                if part in layout
+            ]
+            return pd.concat(parts, axis=1)[layout["columns"]]
+    return load_pandas_data(url)
+
+
+def _is_light(values: pd.Series) -> bool:
+    # Numbers, dates, and categories, which are small and used by the charts.
+    if (
+        pd.api.types.is_numeric_dtype(values)
+        or pd.api.types.is_bool_dtype(values)
+        or pd.api.types.is_datetime64_any_dtype(values)
+        or isinstance(values.dtype, pd.CategoricalDtype)
+    ):
+        return True
+    if pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+        return False
+    return values.nunique() <= CATEGORY_MAX_VALUES
 
 
 class DataSource:
@@ -16,11 +70,147 @@ class DataSource:
         identifier: str,
         dataset: pd.DataFrame,
         metadata: dict,
+        neighbors_sidecar: bool = False,
     ):
         self.identifier = identifier
-        self.dataset = dataset
+        self._dataset: pd.DataFrame | None = dataset
+        self._load_dataset: Callable[[], pd.DataFrame] | None = None
+        # The last dataset loaded after release, while it is still in use.
+        self._loaded_dataset: weakref.ref[pd.DataFrame] | None = None
+        self._load_lock = threading.Lock()
         self.metadata = metadata
+        # The nearest neighbors, if kept apart from the dataset.
+        self.neighbors: NeighborGraph | None = None
+        self._neighbors_column: str | None = None
+        column = metadata.get("columns", {}).get("neighbors")
+        if neighbors_sidecar and column is not None:
+            # Serve the neighbors on demand, instead of with the dataset.
+            self.neighbors = NeighborGraph.from_column(dataset[column])
+            self._neighbors_column = column
+            self.dataset = dataset.drop(columns=[column])
+            columns = {k: v for k, v in metadata["columns"].items() if k != "neighbors"}
+            self.metadata = metadata | {
+                "columns": columns,
+                "neighbors": {"sidecar": NEIGHBORS_SIDECAR},
+            }
         self.cache_path = cache_path("cache", self.identifier)
+        # The status of a projection computed in the background, if any.
+        self.projection_status: dict | None = None
+        self._listeners: list[Callable[[], None]] = []
+        self.layout: dict | None = None
+        self._update_layout()
+
+    @property
+    def dataset(self) -> pd.DataFrame:
+        """The dataset. If it was released (see release_dataset), it is loaded
+        again when accessed, unless a loaded copy is still in use, which is
+        shared so that concurrent readers do not each load the dataset."""
+        dataset = self._dataset
+        if dataset is not None:
+            return dataset
+        with self._load_lock:
+            if self._loaded_dataset is not None:
+                dataset = self._loaded_dataset()
+                if dataset is not None:
+                    return dataset
+            assert self._load_dataset is not None
+            dataset = self._load_dataset()
+            self._loaded_dataset = weakref.ref(dataset)
+            return dataset
+
+    @dataset.setter
+    def dataset(self, value: pd.DataFrame):
+        self._dataset = value
+
+    def release_dataset(self, dataset: pd.DataFrame, load: Callable[[], pd.DataFrame]):
+        """Drops the in-memory dataset, once a copy is stored elsewhere (e.g., in
+        a database), and loads it with `load` when needed from then on. Does
+        nothing if the dataset was updated since the copy of `dataset`."""
+        if self._dataset is dataset:
+            with self._load_lock:
+                self._load_dataset = load
+                self._loaded_dataset = None
+                self._dataset = None
+
+    def _update_layout(self):
+        """Splits the dataset for delivery to the browser, which loads a small
+        preview sample first, then the "hot" columns needed to show all points
+        (the id, the coordinates, numbers and categories), and last the "cold"
+        columns with heavy values (such as long text and images). The layout
+        is described in the metadata; small datasets without heavy columns
+        are not split."""
+        columns = self.metadata.get("columns", {})
+        embedding = columns.get("embedding")
+        self.metadata = {k: v for k, v in self.metadata.items() if k != "layout"}
+        self.layout = None
+        if embedding is None:
+            return
+        dataset = self.dataset
+        required = {columns.get("id"), embedding["x"], embedding["y"]}
+        hot = []
+        cold = []
+        for name in dataset.columns:
+            if name in required or _is_light(dataset[name]):
+                hot.append(name)
+            else:
+                cold.append(name)
+        preview = len(dataset) > PREVIEW_ROWS
+        if not preview and len(cold) == 0:
+            return
+        layout = {
+            "columns": list(dataset.columns),
+            "hot": {"file": LAYOUT_FILES["hot"], "columns": hot},
+        }
+        if preview:
+            layout["preview"] = {"file": LAYOUT_FILES["preview"], "rows": PREVIEW_ROWS}
+        if len(cold) > 0:
+            layout["cold"] = {"file": LAYOUT_FILES["cold"], "columns": cold}
+        self.layout = layout
+        self.metadata = self.metadata | {"layout": layout}
+
+    def add_listener(self, listener: Callable[[], None]):
+        """Adds a function to call after the dataset is updated."""
+        self._listeners.append(listener)
+
+    def update_columns(self, columns: dict):
+        """Replaces (or adds) columns of the dataset. The dataset is replaced
+        as a whole, so readers see either the old or the new columns."""
+        dataset = self.dataset.copy(deep=False)
+        for name, values in columns.items():
+            if name == self._neighbors_column:
+                self.neighbors = NeighborGraph.from_column(values)
+            else:
+                dataset[name] = values
+        self.dataset = dataset
+        self._update_layout()
+        for listener in self._listeners:
+            listener()
+
+    def _sort_by(self) -> tuple[str, str] | None:
+        embedding = self.metadata.get("columns", {}).get("embedding")
+        if embedding is None:
+            return None
+        return (embedding["x"], embedding["y"])
+
+    def write_parquet(self, where, part: LayoutPart | None = None):
+        """Writes the dataset, or a part of its layout, as parquet, with rows
+        in spatial order of the embedding (see utils.write_parquet). All parts
+        have their rows in the same order."""
+        # Held while writing, so that concurrent writers share a loaded dataset.
+        dataset = self.dataset
+        if part is None:
+            write_parquet(dataset, where, sort_by=self._sort_by())
+            return
+        assert self.layout is not None
+        spec = self.layout["hot" if part == "preview" else part]
+        write_parquet(
+            # Without the index, which would be a column of each part.
+            dataset.reset_index(drop=True),
+            where,
+            sort_by=self._sort_by(),
+            columns=spec["columns"],
+            sample=PREVIEW_ROWS if part == "preview" else None,
+        )
 
     def cache_set(self, name: str, data):
         path = self.cache_path / name
@@ -45,7 +235,20 @@ class DataSource:
                     | {"is_static": True, "database": {"type": "wasm", "load": True}}
                 ),
             )
-            zip.writestr("data/dataset.parquet", to_parquet_bytes(self.dataset))
+            # The viewer loads the files of the layout if there is one, and
+            # dataset.parquet otherwise.
+            if self.layout is None:
+                zip.writestr(
+                    "data/dataset.parquet",
+                    to_parquet_bytes(self.dataset, sort_by=self._sort_by()),
+                )
+            for part, spec in (self.layout or {}).items():
+                if part in LAYOUT_FILES:
+                    buffer = BytesIO()
+                    self.write_parquet(buffer, part)  # type: ignore
+                    zip.writestr(f"data/{spec['file']}", buffer.getvalue())
+            if self.neighbors is not None:
+                zip.writestr(f"data/{NEIGHBORS_SIDECAR}", self.neighbors.to_bytes())
             for root, _, files in os.walk(static_path):
                 for fn in files:
                     p = os.path.relpath(os.path.join(root, fn), static_path)
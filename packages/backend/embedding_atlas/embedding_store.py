@@ -0,0 +1,81 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""A content-addressed store for per-row embedding vectors."""
+
+import hashlib
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from .utils import Hasher, cache_path
+
+
+class EmbeddingStore:
+    """Embedding vectors keyed by the hash of the input that produced them.
+
+    Each store holds the vectors for one model (and any other settings that
+    affect the output), so a key only needs to identify the input value.
+    """
+
+    # Maximum number of keys in a single lookup query.
+    _lookup_batch_size = 500
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def open(kind: str, **settings) -> "EmbeddingStore":
+        """Opens the store for the given kind of input and model settings."""
+        hasher = Hasher()
+        hasher.update({"version": 1, "kind": kind, "settings": settings})
+        return EmbeddingStore(cache_path("embeddings") / (hasher.hexdigest() + ".sqlite"))
+
+    @staticmethod
+    def keys_for_texts(texts: list[str]) -> list[bytes]:
+        return [
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            for text in texts
+        ]
+
+    def lookup(self, keys: list[bytes]) -> tuple[np.ndarray, np.ndarray | None]:
+        """Looks up the vectors for the given keys.
+
+        Returns a boolean mask of the keys that were found, and an array with
+        the vectors of the found keys in order (None if nothing was found).
+        """
+        unique_keys = list(dict.fromkeys(keys))
+        blobs: dict[bytes, bytes] = {}
+        for i in range(0, len(unique_keys), self._lookup_batch_size):
+            batch = unique_keys[i : i + self._lookup_batch_size]
+            placeholders = ",".join("?" * len(batch))
+            cursor = self.connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                batch,
+            )
+            blobs.update(cursor.fetchall())
+
+        found = np.array([key in blobs for key in keys], dtype=bool)
+        if len(blobs) == 0:
+            return found, None
+        data = b"".join(blobs[key] for key in keys if key in blobs)
+        vectors = np.frombuffer(data, dtype=np.float32).reshape(int(found.sum()), -1)
+        return found, vectors
+
+    def insert(self, keys: list[bytes], vectors: np.ndarray):
+        """Stores the vectors for the given keys."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            ((key, vector.tobytes()) for key, vector in zip(keys, vectors)),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
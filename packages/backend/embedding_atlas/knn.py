@@ -0,0 +1,182 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""k-nearest-neighbor search engines for the projection."""
+
+import os
+from typing import Literal
+
+import numpy as np
+
+from .utils import logger
+
+KNNEngine = Literal["auto", "exact", "nndescent"]
+
+# Metrics supported by the exact engine.
+EXACT_METRICS = ("cosine", "euclidean")
+
+# The largest number of points for which "auto" picks the exact engine.
+AUTO_EXACT_MAX_POINTS = 50_000
+
+# The memory NN-descent uses per point besides the vectors, in bytes: the
+# neighbor heaps, the candidate lists and the random projection trees.
+NNDESCENT_BYTES_PER_POINT = 1536
+
+
+def resolve_engine(engine: KNNEngine, count: int, metric: str) -> str:
+    """Returns the engine used for `count` points with the given metric."""
+    if engine == "auto":
+        if count <= AUTO_EXACT_MAX_POINTS and metric in EXACT_METRICS:
+            return "exact"
+        return "nndescent"
+    if engine == "exact" and metric not in EXACT_METRICS:
+        raise ValueError(
+            f"the exact kNN engine does not support the {metric!r} metric, use one of {', '.join(EXACT_METRICS)}"
+        )
+    if engine not in ("exact", "nndescent"):
+        raise ValueError(f"unknown kNN engine {engine!r}")
+    return engine
+
+
+def nearest_neighbors(
+    vectors: np.ndarray,
+    n_neighbors: int,
+    metric: str = "cosine",
+    engine: KNNEngine = "auto",
+) -> tuple[np.ndarray, np.ndarray]:
+    """Computes the k nearest neighbors of each point, including the point
+    itself. Returns the indices and distances, with shape (N, n_neighbors),
+    sorted by distance."""
+    engine = resolve_engine(engine, len(vectors), metric)  # type: ignore
+    if engine == "nndescent":
+        check_nndescent_memory(len(vectors), vectors.shape[1])
+    logger.info("Computing kNN graph with the %s engine...", engine)
+    if engine == "exact":
+        return exact_nearest_neighbors(vectors, n_neighbors, metric)
+    else:
+        return nndescent_nearest_neighbors(vectors, n_neighbors, metric)
+
+
+def nndescent_memory(count: int, dim: int) -> int:
+    """An estimate of the peak memory of NN-descent, in bytes. All points are
+    in one index, with the vectors (and a normalized copy) in memory."""
+    return count * (8 * dim + NNDESCENT_BYTES_PER_POINT)
+
+
+def _physical_memory() -> int | None:
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        # Not available on this platform.
+        return None
+
+
+def check_nndescent_memory(count: int, dim: int):
+    """Refuses to run NN-descent when it would need more memory than the
+    machine has, instead of running out of memory, and warns when it needs
+    more than half of it."""
+    needed = nndescent_memory(count, dim)
+    memory = _physical_memory()
+    if memory is None or 2 * needed <= memory:
+        return
+    message = (
+        f"NN-descent on {count} points with {dim} dimensions needs about"
+        f" {needed / 2**30:.1f} GB of memory, and this machine has"
+        f" {memory / 2**30:.1f} GB"
+    )
+    if needed > memory:
+        raise MemoryError(
+            message
+            + ". Reduce the dimensions (e.g., with PCA) or the number of points."
+        )
+    logger.warning(message)
+
+
+def exact_nearest_neighbors(
+    vectors: np.ndarray,
+    n_neighbors: int,
+    metric: str = "cosine",
+    memory_budget: int = 256 * 1024 * 1024,
+    queries: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Exact kNN by brute force. Distances to all points are computed with a
+    matrix product, one block of query rows at a time, with blocks sized so
+    that the distances of a block and their partition indices fit in
+    `memory_budget` bytes.
+
+    If `queries` is given, returns the neighbors of the queries among the
+    vectors instead of the neighbors of the vectors themselves."""
+    if metric not in EXACT_METRICS:
+        raise ValueError(f"unsupported metric {metric!r}")
+
+    def prepare(value: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        value = np.ascontiguousarray(value, dtype=np.float32)
+        if metric == "cosine":
+            norms = np.linalg.norm(value, axis=1, keepdims=True)
+            return value / np.maximum(norms, np.finfo(np.float32).tiny), None
+        else:
+            return value, np.einsum("ij,ij->i", value, value)
+
+    data, squared_norms = prepare(vectors)
+    if queries is None:
+        query_data, query_squared_norms = data, squared_norms
+    else:
+        query_data, query_squared_norms = prepare(queries)
+    count = len(data)
+    query_count = len(query_data)
+    k = min(n_neighbors, count)
+
+    block_size = max(1, min(query_count, memory_budget // max(1, 12 * count)))
+    indices = np.empty((query_count, k), dtype=np.int32)
+    distances = np.empty((query_count, k), dtype=np.float32)
+    for start in range(0, query_count, block_size):
+        end = min(start + block_size, query_count)
+        block = query_data[start:end] @ data.T
+        if metric == "cosine":
+            # 1 - cosine similarity
+            np.subtract(1, block, out=block)
+        else:
+            assert squared_norms is not None and query_squared_norms is not None
+            block *= -2
+            block += query_squared_norms[start:end, None]
+            block += squared_norms[None, :]
+        if queries is None:
+            # Each point is its own first neighbor.
+            rows = np.arange(end - start)
+            block[rows, rows + start] = -np.inf
+        if k < count:
+            top = np.argpartition(block, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(count), (end - start, count))
+        top_distances = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind="stable")
+        indices[start:end] = np.take_along_axis(top, order, axis=1)
+        distances[start:end] = np.take_along_axis(top_distances, order, axis=1)
+
+    if queries is None:
+        distances[:, 0] = 0
+    np.maximum(distances, 0, out=distances)
+    if metric == "euclidean":
+        np.sqrt(distances, out=distances)
+    return indices, distances
+
+
+def nndescent_nearest_neighbors(
+    vectors: np.ndarray,
+    n_neighbors: int,
+    metric: str = "cosine",
+) -> tuple[np.ndarray, np.ndarray]:
+    """Approximate kNN with NN-descent, as used by UMAP."""
+    from umap.umap_ import nearest_neighbors
+
+    if not vectors.flags.writeable:
+        # The numba kernels do not accept read-only arrays.
+        vectors = np.array(vectors)
+    indices, distances, _ = nearest_neighbors(
+        vectors,
+        n_neighbors=n_neighbors,
+        metric=metric,
+        metric_kwds=None,
+        angular=False,
+        random_state=None,
+    )
+    return indices, distances
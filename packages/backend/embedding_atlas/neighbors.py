@@ -0,0 +1,124 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""Nearest neighbor graphs kept apart from the dataset and served on demand."""
+
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The sidecar file format, little-endian:
+#   magic (8 bytes), version (uint32), reserved (uint32), count (uint64), nnz (uint64)
+#   indptr: int64[count + 1]
+#   ids: int32[nnz]
+#   distances: float32[nnz]
+# The arrays are aligned, so readers can view them in place.
+MAGIC = b"EANEIGHB"
+VERSION = 1
+_header = struct.Struct("<8sIIQQ")
+
+
+@dataclass
+class NeighborGraph:
+    """A nearest neighbor graph in CSR form: the neighbors of row i are
+    ids[indptr[i]:indptr[i + 1]], with the corresponding distances, sorted by
+    distance."""
+
+    indptr: np.ndarray
+    ids: np.ndarray
+    distances: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    @staticmethod
+    def from_column(values) -> "NeighborGraph":
+        """Builds the graph from a neighbors column, with values of the form
+        {"ids": [...], "distances": [...]}. Arrow-backed columns (see
+        projection.neighbors_column) are converted without iterating over rows."""
+        if isinstance(values, pd.Series):
+            values = values.array
+        if isinstance(values, pd.arrays.ArrowExtensionArray):
+            array = values.__arrow_array__().combine_chunks()
+            distances, ids = (array.field(name) for name in ["distances", "ids"])
+            if array.offset != 0:
+                distances = distances.slice(array.offset, len(array))
+                ids = ids.slice(array.offset, len(array))
+            lengths = pc.fill_null(pc.list_value_length(ids), 0).to_numpy()
+            return NeighborGraph(
+                np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+                _flat_values(ids, np.int32),
+                _flat_values(distances, np.float32),
+            )
+
+        rows = [{"ids": [], "distances": []} if v is None else v for v in values]
+        ids = [np.asarray(row["ids"], dtype=np.int32) for row in rows]
+        distances = [np.asarray(row["distances"], dtype=np.float32) for row in rows]
+        return NeighborGraph(
+            np.concatenate([[0], np.cumsum([len(x) for x in ids], dtype=np.int64)]),
+            np.concatenate([np.zeros(0, np.int32)] + ids),
+            np.concatenate([np.zeros(0, np.float32)] + distances),
+        )
+
+    def lookup(self, rows: list[int]) -> list[dict]:
+        """Returns the neighbor ids and distances of each of the given rows."""
+        result = []
+        for row in rows:
+            if not 0 <= row < len(self):
+                raise IndexError(f"row {row} is out of range")
+            start, end = self.indptr[row], self.indptr[row + 1]
+            result.append(
+                {
+                    "ids": self.ids[start:end].tolist(),
+                    "distances": self.distances[start:end].tolist(),
+                }
+            )
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Serializes the graph in the sidecar file format."""
+        header = _header.pack(MAGIC, VERSION, 0, len(self), len(self.ids))
+        return b"".join(
+            [
+                header,
+                np.ascontiguousarray(self.indptr, dtype="<i8").tobytes(),
+                np.ascontiguousarray(self.ids, dtype="<i4").tobytes(),
+                np.ascontiguousarray(self.distances, dtype="<f4").tobytes(),
+            ]
+        )
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "NeighborGraph":
+        """Reads a graph in the sidecar file format. The arrays are views of the data."""
+        magic, version, _, count, nnz = _header.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a neighbor graph file")
+        offset = _header.size
+        indptr = np.frombuffer(data, "<i8", count + 1, offset)
+        offset += indptr.nbytes
+        ids = np.frombuffer(data, "<i4", nnz, offset)
+        offset += ids.nbytes
+        distances = np.frombuffer(data, "<f4", nnz, offset)
+        return NeighborGraph(indptr, ids, distances)
+
+    def to_column(self) -> pd.arrays.ArrowExtensionArray:
+        """Returns the graph as a neighbors column."""
+        offsets = pa.array(self.indptr, pa.int64())
+        return pd.arrays.ArrowExtensionArray(
+            pa.StructArray.from_arrays(
+                [
+                    pa.LargeListArray.from_arrays(offsets, pa.array(self.distances)),
+                    pa.LargeListArray.from_arrays(offsets, pa.array(self.ids)),
+                ],
+                names=["distances", "ids"],
+            )
+        )
+
+
+def _flat_values(array: pa.Array, dtype) -> np.ndarray:
+    # The values of the (non-null) lists, in order.
+    values = pc.list_flatten(array).to_numpy(zero_copy_only=False)
+    return values.astype(dtype, copy=False)
@@ -0,0 +1,72 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+"""Dimensionality reduction with randomized PCA, out of core."""
+
+import numpy as np
+
+
+def randomized_pca(
+    vectors: np.ndarray,
+    n_components: int,
+    chunk_size: int = 65536,
+    n_oversamples: int = 10,
+    n_iter: int = 4,
+    random_state: int = 0,
+) -> np.ndarray:
+    """Projects the vectors onto their top `n_components` principal components.
+
+    The components are found by randomized subspace iteration on the
+    covariance matrix (Halko et al.), which is applied one chunk of
+    `chunk_size` rows at a time without being formed. `vectors` can thus be a
+    memory-mapped array larger than memory: besides the float32 result, only
+    matrices of size dim x (n_components + n_oversamples) are held in memory.
+    """
+    count = len(vectors)
+    mean, components = principal_components(
+        vectors, n_components, chunk_size, n_oversamples, n_iter, random_state
+    )
+    result = np.empty((count, len(components)), dtype=np.float32)
+    for i in range(0, count, chunk_size):
+        s = slice(i, min(i + chunk_size, count))
+        result[s] = (np.asarray(vectors[s], dtype=np.float64) - mean) @ components.T
+    return result
+
+
+def principal_components(
+    vectors: np.ndarray,
+    n_components: int,
+    chunk_size: int = 65536,
+    n_oversamples: int = 10,
+    n_iter: int = 4,
+    random_state: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the mean of the vectors and their top `n_components` principal
+    components, with shape (n_components, dim). See randomized_pca."""
+    count, dim = vectors.shape
+    rank = min(n_components + n_oversamples, count, dim)
+    chunks = [slice(i, min(i + chunk_size, count)) for i in range(0, count, chunk_size)]
+
+    mean = np.zeros(dim)
+    for s in chunks:
+        mean += np.asarray(vectors[s], dtype=np.float64).sum(axis=0)
+    mean /= count
+
+    def covariance_product(z: np.ndarray) -> np.ndarray:
+        # (X - mean)^T (X - mean) z, in one pass over the data.
+        result = np.zeros_like(z)
+        for s in chunks:
+            x = np.asarray(vectors[s], dtype=np.float64) - mean
+            result += x.T @ (x @ z)
+        return result
+
+    rng = np.random.default_rng(random_state)
+    z, _ = np.linalg.qr(rng.standard_normal((dim, rank)))
+    for _ in range(n_iter):
+        z, _ = np.linalg.qr(covariance_product(z))
+
+    # Rayleigh-Ritz: the eigenvectors of the covariance restricted to the
+    # subspace give the principal components.
+    eigenvalues, eigenvectors = np.linalg.eigh(z.T @ covariance_product(z))
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    components = (z @ eigenvectors[:, order]).T
+    return mean, components
@@ -1,91 +1,731 @@
 # Copyright (c) 2025 Apple Inc. Licensed under MIT License.
 
-from dataclasses import dataclass
+import json
+import os
+import platform
+import shutil
+import struct
+import threading
+import zlib
+from dataclasses import dataclass, fields
 from pathlib import Path
+from typing import Callable, Iterator, Literal
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 
+from .embedding_store import EmbeddingStore
+from .knn import KNNEngine, nearest_neighbors, resolve_engine
 from .utils import Hasher, cache_path, logger
 
 
+# The cache file format of array artifacts: a fixed-size header region, with
+#   magic (8 bytes), version (uint32), header length (uint32), header CRC-32 (uint32)
+#   and a JSON header that describes each array (dtype, shape, offset, checksum),
+# followed by the raw arrays at aligned offsets.
+_ARTIFACT_MAGIC = b"EAARRAYS"
+_ARTIFACT_VERSION = 1
+_artifact_prefix = struct.Struct("<8sIII")
+_artifact_header_size = 4096
+_artifact_alignment = 64
+
+
+def _artifact_array(array: np.ndarray, offset: int) -> dict:
+    return {
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "offset": offset,
+        "nbytes": array.nbytes,
+        "checksum": _digest(array),
+    }
+
+
+def _write_artifact_header(file, arrays: dict[str, dict]):
+    header = json.dumps({"arrays": arrays}).encode("utf-8")
+    prefix = _artifact_prefix.pack(
+        _ARTIFACT_MAGIC, _ARTIFACT_VERSION, len(header), zlib.crc32(header)
+    )
+    if len(prefix) + len(header) > _artifact_header_size:
+        raise ValueError("too many arrays for the artifact header")
+    file.seek(0)
+    file.write(prefix + header)
+
+
+def _read_artifact_header(path: Path) -> dict[str, dict] | None:
+    """Returns the descriptions of the arrays in the artifact file, or None if
+    the file is missing, from another version, or damaged."""
+    try:
+        with open(path, "rb") as f:
+            prefix = f.read(_artifact_prefix.size)
+            magic, version, length, crc = _artifact_prefix.unpack(prefix)
+            header = f.read(length)
+        size = path.stat().st_size
+    except (OSError, struct.error):
+        return None
+    if (
+        magic != _ARTIFACT_MAGIC
+        or version != _ARTIFACT_VERSION
+        or zlib.crc32(header) != crc
+    ):
+        return None
+    arrays = json.loads(header)["arrays"]
+    if any(
+        a["nbytes"] > 0 and a["offset"] + a["nbytes"] > size for a in arrays.values()
+    ):
+        return None
+    return arrays
+
+
+def _temporary_path(path: Path) -> Path:
+    # Unique per process, so that concurrent writers do not collide.
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+class _ArrayArtifact:
+    """A dataclass of arrays, cached as a single file.
+
+    The file is written to a temporary path and renamed into place, so readers
+    never see a partial file, and its arrays are memory-mapped when loaded, so
+    only the pages that are used are read."""
+
+    @classmethod
+    def file_path(cls, path: Path) -> Path:
+        return path.with_name(path.name + ".arrays")
+
+    @classmethod
+    def exists(cls, path: Path):
+        arrays = _read_artifact_header(cls.file_path(path))
+        return arrays is not None and all(f.name in arrays for f in fields(cls))  # type: ignore
+
+    @classmethod
+    def save(cls, path: Path, value):
+        arrays = {}
+        offset = _artifact_header_size
+        for f in fields(cls):  # type: ignore
+            array = np.ascontiguousarray(getattr(value, f.name))
+            if array.dtype.hasobject:
+                raise ValueError(f"cannot cache object array {f.name!r}")
+            arrays[f.name] = array
+        file_path = cls.file_path(path)
+        tmp_path = _temporary_path(file_path)
+        try:
+            with open(tmp_path, "wb") as file:
+                descriptions = {}
+                for name, array in arrays.items():
+                    descriptions[name] = _artifact_array(array, offset)
+                    file.seek(offset)
+                    file.write(memoryview(array.reshape(-1).view(np.uint8)))
+                    offset += -(-array.nbytes // _artifact_alignment) * _artifact_alignment
+                _write_artifact_header(file, descriptions)
+            os.replace(tmp_path, file_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: Path, verify: bool = False):
+        """Memory-maps the arrays (copy-on-write). With `verify`, the checksums
+        of the arrays are checked, which reads them in full."""
+        file_path = cls.file_path(path)
+        arrays = _read_artifact_header(file_path)
+        if arrays is None:
+            raise ValueError(f"invalid or missing cache file {file_path}")
+        values = {}
+        for f in fields(cls):  # type: ignore
+            a = arrays[f.name]
+            shape = tuple(a["shape"])
+            if a["nbytes"] == 0:
+                value = np.zeros(shape, dtype=a["dtype"])
+            else:
+                value = np.memmap(
+                    file_path, a["dtype"], "c", a["offset"], shape
+                ).view(np.ndarray)
+            if verify and _digest(value) != a["checksum"]:
+                raise ValueError(f"checksum mismatch for {f.name!r} in {file_path}")
+            values[f.name] = value
+        return cls(**values)
+
+
 @dataclass
-class Projection:
-    # Array with shape (N, embedding_dim), the high-dimensional embedding
+class Projection(_ArrayArtifact):
+    # Array with shape (N, 2), the 2D projection
     projection: np.ndarray
 
     knn_indices: np.ndarray
     knn_distances: np.ndarray
 
-    @staticmethod
-    def exists(path: Path):
-        return (
-            path.with_suffix(".projection.npy").exists()
-            and path.with_suffix(".knn_indices.npy").exists()
-            and path.with_suffix(".knn_distances.npy").exists()
+
+@dataclass
+class Embeddings(_ArrayArtifact):
+    # Array with shape (N, embedding_dim), the high-dimensional embedding
+    vectors: np.ndarray
+
+
+@dataclass
+class KNNGraph(_ArrayArtifact):
+    # Arrays with shape (N, n_neighbors), sorted by distance
+    indices: np.ndarray
+    distances: np.ndarray
+
+
+@dataclass
+class Layout(_ArrayArtifact):
+    # Array with shape (N, 2), the 2D projection
+    projection: np.ndarray
+
+
+class _EmbeddingCheckpoint:
+    """Embeddings written progressively to a memory-mapped file next to the
+    Embeddings artifact at `path`, with a manifest of the number of leading
+    rows completed, so that an interrupted run can resume where it stopped.
+    The file is laid out as the artifact, so it becomes the artifact once its
+    header is written."""
+
+    def __init__(self, path: Path, count: int):
+        self.path = path
+        self.vectors_path = path.with_name(path.name + ".partial.arrays")
+        self.manifest_path = path.with_name(path.name + ".partial.json")
+        self.count = count
+        self.completed = 0
+        self.vectors: np.ndarray | None = None
+
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            if manifest["version"] == 2 and manifest["count"] == count:
+                self.vectors = self._open("r+", manifest["dim"])
+                self.completed = manifest["completed"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _open(self, mode: str, dim: int) -> np.ndarray:
+        return np.memmap(
+            self.vectors_path,
+            np.float32,
+            mode,  # type: ignore
+            _artifact_header_size,
+            (self.count, dim),
         )
 
-    @staticmethod
-    def save(path: Path, value: "Projection"):
-        np.save(
-            path.with_suffix(".projection.npy"),
-            value.projection,
-            allow_pickle=False,
+    def write(self, start: int, vectors: np.ndarray):
+        if self.vectors is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.vectors = self._open("w+", vectors.shape[1])
+        self.vectors[start : start + len(vectors)] = vectors
+
+    def commit(self, completed: int):
+        """Records that the first `completed` rows are written."""
+        assert self.vectors is not None
+        self.vectors.flush()  # type: ignore
+        self.completed = completed
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": 2,
+                    "count": self.count,
+                    "dim": self.vectors.shape[1],
+                    "completed": completed,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.manifest_path)
+
+    def finish(self) -> np.ndarray:
+        """Turns the checkpoint into the Embeddings artifact, and returns the
+        vectors memory-mapped from it."""
+        assert self.vectors is not None and self.completed == self.count
+        self.vectors.flush()  # type: ignore
+        description = _artifact_array(self.vectors.view(np.ndarray), _artifact_header_size)
+        self.vectors = None
+        with open(self.vectors_path, "r+b") as file:
+            _write_artifact_header(file, {"vectors": description})
+        os.replace(self.vectors_path, Embeddings.file_path(self.path))
+        self.manifest_path.unlink()
+        return Embeddings.load(self.path).vectors
+
+
+def _digest(value) -> str:
+    hasher = Hasher()
+    hasher.update(value)
+    return hasher.hexdigest()
+
+
+EmbeddingBackend = Literal["torch", "onnx", "onnx-int8"]
+
+
+def _exported_model_path(kind: str, model: str, backend: EmbeddingBackend) -> Path:
+    return cache_path("models") / _digest(
+        {"version": 1, "kind": kind, "model": model, "backend": backend}
+    )
+
+
+def _quantization_target() -> str:
+    machine = platform.machine().lower()
+    return "arm64" if machine in ("arm64", "aarch64") else "avx2"
+
+
+def _move_export_into_place(tmp_path: Path, path: Path):
+    try:
+        tmp_path.rename(path)
+    except OSError:
+        if not path.exists():
+            raise
+        # Another process exported the model first.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _import_onnx_backend():
+    try:
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "The ONNX embedding backends require optimum with onnxruntime. Please run `pip install optimum[onnxruntime]`, then try again."
+        )
+
+
+def _export_sentence_transformer(
+    model: str,
+    trust_remote_code: bool,
+    backend: EmbeddingBackend,
+    device: str | None = None,
+) -> Path:
+    """Exports (and quantizes) a text model for an ONNX backend once, and
+    returns the path of the export in the cache."""
+    from sentence_transformers import SentenceTransformer
+
+    _import_onnx_backend()
+    path = _exported_model_path("text", model, backend)
+    if not path.exists():
+        logger.info("Exporting model %s for the %s backend...", model, backend)
+        exported = SentenceTransformer(
+            model, backend="onnx", trust_remote_code=trust_remote_code, device=device
         )
-        np.save(
-            path.with_suffix(".knn_indices.npy"),
-            value.knn_indices,
-            allow_pickle=False,
+        tmp_path = _temporary_path(path)
+        exported.save(str(tmp_path))
+        if backend == "onnx-int8":
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            export_dynamic_quantized_onnx_model(
+                exported, _quantization_target(), str(tmp_path)  # type: ignore
+            )
+        _move_export_into_place(tmp_path, path)
+    return path
+
+
+def _load_sentence_transformer(
+    model: str,
+    trust_remote_code: bool = False,
+    backend: EmbeddingBackend = "torch",
+    device: str | None = None,
+):
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(
+            model, trust_remote_code=trust_remote_code, device=device
         )
-        np.save(
-            path.with_suffix(".knn_distances.npy"),
-            value.knn_distances,
-            allow_pickle=False,
+
+    path = _export_sentence_transformer(model, trust_remote_code, backend, device)
+
+    if backend == "onnx-int8":
+        file_name = next((path / "onnx").glob("model_*int8_*.onnx")).relative_to(path)
+    else:
+        file_name = Path("onnx") / "model.onnx"
+    return SentenceTransformer(
+        str(path),
+        backend="onnx",
+        model_kwargs={"file_name": file_name.as_posix()},
+        trust_remote_code=trust_remote_code,
+        device=device,
+    )
+
+
+def _load_image_model(model: str, backend: EmbeddingBackend = "torch"):
+    """Loads an image model. Returns its image processor, and a function that
+    runs the model on preprocessed inputs and returns the last hidden state."""
+    import torch
+
+    if backend == "torch":
+        from transformers import pipeline
+
+        pipe = pipeline("image-feature-extraction", model=model, device_map="auto")
+
+        def forward(inputs: dict) -> torch.Tensor:
+            inputs = {
+                k: (v.to(pipe.model.dtype) if torch.is_floating_point(v) else v).to(
+                    pipe.device
+                )
+                for k, v in inputs.items()
+            }
+            return pipe.model(**inputs)[0]
+
+        return pipe.image_processor, forward
+
+    # Export (and quantize) the model once, and load it from the cache after.
+    _import_onnx_backend()
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoImageProcessor
+
+    path = _exported_model_path("image", model, backend)
+    if not path.exists():
+        logger.info("Exporting model %s for the %s backend...", model, backend)
+        tmp_path = _temporary_path(path)
+        exported = ORTModelForFeatureExtraction.from_pretrained(model, export=True)
+        exported.save_pretrained(tmp_path)
+        AutoImageProcessor.from_pretrained(model).save_pretrained(tmp_path)
+        if backend == "onnx-int8":
+            from optimum.onnxruntime import ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+            config = getattr(AutoQuantizationConfig, _quantization_target())(
+                is_static=False
+            )
+            ORTQuantizer.from_pretrained(exported).quantize(
+                save_dir=tmp_path, quantization_config=config
+            )
+        _move_export_into_place(tmp_path, path)
+
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(
+        path,
+        file_name="model_quantized.onnx" if backend == "onnx-int8" else "model.onnx",
+    )
+
+    def forward(inputs: dict) -> torch.Tensor:
+        return ort_model(**inputs)[0]
+
+    return AutoImageProcessor.from_pretrained(path), forward
+
+
+def _reduced_embeddings(
+    embeddings: Callable[[], np.ndarray], embeddings_digest: str, pca_dims: int
+) -> tuple[Callable[[], np.ndarray], str]:
+    """Wraps `embeddings` to reduce them with randomized PCA, returning the
+    wrapped function and the digest of the reduced embeddings."""
+    digest = _digest(
+        {"version": 1, "embeddings": embeddings_digest, "pca_dims": pca_dims}
+    )
+    cpath = cache_path("reduced") / digest
+
+    def reduced() -> np.ndarray:
+        if Embeddings.exists(cpath):
+            logger.info("Using cached reduced embeddings from %s", str(cpath))
+            return Embeddings.load(cpath).vectors
+        vectors = embeddings()
+        if pca_dims >= vectors.shape[1]:
+            return vectors
+        logger.info(
+            "Reducing embeddings from %d to %d dimensions with PCA...",
+            vectors.shape[1],
+            pca_dims,
         )
+        from .pca import randomized_pca
 
-    @staticmethod
-    def load(path: Path) -> "Projection":
-        return Projection(
-            projection=np.load(
-                path.with_suffix(".projection.npy"),
-                allow_pickle=False,
-            ),
-            knn_indices=np.load(
-                path.with_suffix(".knn_indices.npy"),
-                allow_pickle=False,
-            ),
-            knn_distances=np.load(
-                path.with_suffix(".knn_distances.npy"),
-                allow_pickle=False,
-            ),
+        result = randomized_pca(vectors, pca_dims)
+        Embeddings.save(cpath, Embeddings(vectors=result))
+        return result
+
+    return reduced, digest
+
+
+def _deduplicate(keys: list) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the row of the first occurrence of each distinct key, and for
+    each row the position of its key among the distinct keys."""
+    positions: dict = {}
+    inverse = np.fromiter(
+        (positions.setdefault(key, len(positions)) for key in keys),
+        dtype=np.int64,
+        count=len(keys),
+    )
+    _, first = np.unique(inverse, return_index=True)
+    return first, inverse
+
+
+# Rows hashed or compared at a time by _unique_rows.
+_unique_rows_chunk_size = 8192
+
+
+def _row_digests(vectors: np.ndarray) -> np.ndarray:
+    """A 128-bit digest of the bytes of each row, computed one chunk of rows at
+    a time. Each half is a sum of the row's 64-bit words times random odd
+    multipliers, so rows that differ collide with negligible probability."""
+    row_bytes = vectors.dtype.itemsize * vectors.shape[1]
+    words = -(-row_bytes // 8)
+    rng = np.random.default_rng(0)
+    multipliers = rng.integers(0, 2**63, size=(2, words), dtype=np.uint64) * 2 + 1
+    digests = np.empty((len(vectors), 2), dtype=np.uint64)
+    for start in range(0, len(vectors), _unique_rows_chunk_size):
+        chunk = np.ascontiguousarray(vectors[start : start + _unique_rows_chunk_size])
+        chunk = chunk.view(np.uint8).reshape(len(chunk), row_bytes)
+        if row_bytes % 8 != 0:
+            chunk = np.pad(chunk, ((0, 0), (0, words * 8 - row_bytes)))
+        chunk = chunk.view(np.uint64)
+        for half in range(2):
+            products = chunk * multipliers[half]
+            digests[start : start + len(chunk), half] = products.sum(
+                axis=1, dtype=np.uint64
+            )
+    return digests
+
+
+def _unique_rows(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Like _deduplicate, for the rows of a 2D array.
+
+    Rows are grouped by their digest (see _row_digests), so the memory used is
+    proportional to the number of rows rather than the size of the array, and
+    the rows of a group are compared to confirm that they are identical."""
+    digests = _row_digests(vectors)
+    _, first, inverse = np.unique(
+        digests.view(np.dtype((np.void, digests.itemsize * 2))).ravel(),
+        return_index=True,
+        return_inverse=True,
+    )
+    inverse = inverse.ravel()
+    representative = first[inverse]
+    duplicates = np.flatnonzero(representative != np.arange(len(vectors)))
+    collisions = []
+    for start in range(0, len(duplicates), _unique_rows_chunk_size):
+        rows = duplicates[start : start + _unique_rows_chunk_size]
+        a = np.ascontiguousarray(vectors[rows]).view(np.uint8)
+        b = np.ascontiguousarray(vectors[representative[rows]]).view(np.uint8)
+        collisions.extend(rows[(a != b).any(axis=1)])
+    if len(collisions) > 0:
+        # Rows with the same digest but different values get groups of their own.
+        groups: dict[tuple[int, bytes], int] = {}
+        extra_first = []
+        for row in collisions:
+            key = (int(inverse[row]), vectors[row].tobytes())
+            if key not in groups:
+                groups[key] = len(first) + len(extra_first)
+                extra_first.append(row)
+            inverse[row] = groups[key]
+        first = np.concatenate([first, np.asarray(extra_first, dtype=first.dtype)])
+    # Keep the distinct rows in order of first occurrence.
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse]
+
+
+def _log_deduplication(kind: str, count: int, unique_count: int):
+    if count > 0 and unique_count < count:
+        logger.info(
+            "Found %d distinct %s in %d rows (%.1f%% duplicates)",
+            unique_count,
+            kind,
+            count,
+            100 * (1 - unique_count / count),
         )
 
 
+def _take_neighbors(indices: np.ndarray, mapping: np.ndarray) -> np.ndarray:
+    # Missing neighbors are -1 and stay -1.
+    return np.where(indices >= 0, mapping[np.maximum(indices, 0)], -1)
+
+
 def _run_umap(
-    hidden_vectors: np.ndarray,
+    embeddings: Callable[[], np.ndarray],
+    embeddings_digest: str,
+    count: int,
     umap_args: dict = {},
+    knn_engine: KNNEngine = "auto",
+    fit_sample: int | None = None,
+    workers: int | None = None,
+    pca_dims: int | None = None,
 ) -> Projection:
-    logger.info("Running UMAP for input with shape %s...", str(hidden_vectors.shape))  # type: ignore
+    """Computes the kNN graph and the 2D layout for the embeddings.
 
-    import umap
-    from umap.umap_ import nearest_neighbors
+    The kNN graph is cached by the embeddings digest, metric, number of
+    neighbors and kNN engine, and the layout by the kNN graph and the UMAP
+    arguments, so changing the UMAP arguments does not require the embeddings
+    again unless the layout needs to be recomputed. `embeddings` is only called if needed,
+    and `count` is the number of rows it returns.
+
+    If `fit_sample` is given, UMAP is fitted on a random sample of that many
+    rows, and the other rows are placed with `UMAP.transform`, in chunks and on
+    `workers` processes if given (see _fit_transform_sampled).
+
+    If `pca_dims` is given, the embeddings are first reduced to that many
+    dimensions with randomized PCA, and the reduced embeddings are cached.
+
+    Identical vectors are collapsed before the kNN graph and the layout are
+    computed: duplicate rows are placed at the same position, and the first
+    neighbor of a duplicate row is the first row with the same vector.
+    """
+    if pca_dims is not None:
+        embeddings, embeddings_digest = _reduced_embeddings(
+            embeddings, embeddings_digest, pca_dims
+        )
 
     metric = umap_args.get("metric", "cosine")
     n_neighbors = umap_args.get("n_neighbors", 15)
+    knn_engine = resolve_engine(knn_engine, count, metric)  # type: ignore
 
-    knn = nearest_neighbors(
-        hidden_vectors,
-        n_neighbors=n_neighbors,
-        metric=metric,
-        metric_kwds=None,
-        angular=False,
-        random_state=None,
+    knn_digest = _digest(
+        {
+            "version": 2,
+            "embeddings": embeddings_digest,
+            "metric": metric,
+            "n_neighbors": n_neighbors,
+            "engine": knn_engine,
+        }
     )
+    layout_digest = _digest(
+        {
+            "version": 1,
+            "knn": knn_digest,
+            "umap_args": umap_args,
+            "fit_sample": fit_sample,
+        }
+    )
+    knn_path = cache_path("knn") / knn_digest
+    layout_path = cache_path("layouts") / layout_digest
+
+    if KNNGraph.exists(knn_path) and Layout.exists(layout_path):
+        logger.info("Using cached projection from %s", str(layout_path))
+        knn = KNNGraph.load(knn_path)
+        layout = Layout.load(layout_path)
+        return Projection(
+            projection=layout.projection,
+            knn_indices=knn.indices,
+            knn_distances=knn.distances,
+        )
+
+    hidden_vectors = embeddings()
+
+    # The kNN graph and the layout are computed on the distinct vectors, and
+    # mapped back to the rows.
+    first, inverse = _unique_rows(hidden_vectors)
+    _log_deduplication("vectors", len(hidden_vectors), len(first))
+    unique_vectors = hidden_vectors[first] if len(first) < len(hidden_vectors) else hidden_vectors
+
+    if KNNGraph.exists(knn_path):
+        logger.info("Using cached kNN graph from %s", str(knn_path))
+        knn = KNNGraph.load(knn_path)
+    else:
+        logger.info("Computing kNN graph for input with shape %s...", str(unique_vectors.shape))  # type: ignore
+
+        indices, distances = nearest_neighbors(
+            unique_vectors, n_neighbors, metric=metric, engine=knn_engine
+        )
+        knn = KNNGraph(
+            indices=_take_neighbors(indices[inverse], first),
+            distances=distances[inverse],
+        )
+        KNNGraph.save(knn_path, knn)
+
+    if fit_sample is not None and fit_sample < len(unique_vectors):
+        result = _fit_transform_sampled(
+            unique_vectors, umap_args, fit_sample, workers=workers
+        )[inverse]
+        Layout.save(layout_path, Layout(projection=result))
+        return Projection(
+            projection=result, knn_indices=knn.indices, knn_distances=knn.distances
+        )
+
+    logger.info("Running UMAP for input with shape %s...", str(unique_vectors.shape))  # type: ignore
+
+    import umap
+
+    proj = umap.UMAP(
+        **umap_args,
+        precomputed_knn=(
+            _take_neighbors(knn.indices[first], inverse),
+            knn.distances[first],
+        ),
+    )
+    result: np.ndarray = proj.fit_transform(unique_vectors)[inverse]  # type: ignore
+
+    Layout.save(layout_path, Layout(projection=result))
+    return Projection(
+        projection=result, knn_indices=knn.indices, knn_distances=knn.distances
+    )
+
+
+# Number of rows placed by one UMAP.transform call.
+_transform_chunk_size = 50_000
+
+# The fitted UMAP model of a transform worker process.
+_worker_umap = None
+
+
+def _init_transform_worker(model):
+    global _worker_umap
+    _worker_umap = model
 
-    proj = umap.UMAP(**umap_args, precomputed_knn=knn)
-    result: np.ndarray = proj.fit_transform(hidden_vectors)  # type: ignore
 
-    return Projection(projection=result, knn_indices=knn[0], knn_distances=knn[1])
+def _transform_in_worker(vectors: np.ndarray) -> np.ndarray:
+    assert _worker_umap is not None
+    return _worker_umap.transform(vectors)  # type: ignore
+
+
+def _fit_transform_sampled(
+    vectors: np.ndarray,
+    umap_args: dict,
+    fit_sample: int,
+    workers: int | None = None,
+) -> np.ndarray:
+    """Fits UMAP on a random sample of the rows, and places the other rows with
+    UMAP.transform, one chunk at a time. With `workers` greater than 1, the
+    chunks are transformed on a pool of processes, each with a copy of the
+    fitted model."""
+    import tqdm
+    import umap
+
+    rng = np.random.default_rng(umap_args.get("random_state", 0))
+    sample = np.sort(rng.choice(len(vectors), size=fit_sample, replace=False))
+    rest = np.setdiff1d(np.arange(len(vectors)), sample, assume_unique=True)
+
+    logger.info("Fitting UMAP on a sample of %d of %d rows...", fit_sample, len(vectors))
+    model = umap.UMAP(**umap_args)
+    result = np.empty((len(vectors), 2), dtype=np.float32)
+    result[sample] = model.fit_transform(vectors[sample])  # type: ignore
+
+    logger.info("Placing the remaining %d rows...", len(rest))
+    chunks = [
+        rest[i : i + _transform_chunk_size]
+        for i in range(0, len(rest), _transform_chunk_size)
+    ]
+    with tqdm.tqdm(total=len(rest), smoothing=0.1) as progress:
+        if workers is not None and workers > 1:
+            import multiprocessing
+
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(
+                workers, initializer=_init_transform_worker, initargs=(model,)
+            ) as pool:
+                placed = pool.imap(_transform_in_worker, (vectors[c] for c in chunks))
+                for chunk, positions in zip(chunks, placed):
+                    result[chunk] = positions
+                    progress.update(len(chunk))
+        else:
+            for chunk in chunks:
+                result[chunk] = model.transform(vectors[chunk])  # type: ignore
+                progress.update(len(chunk))
+    return result
+
+
+def _cached_projection_path(cache_key: str) -> Path:
+    return cache_path("projections") / _digest({"version": 1, "cache_key": cache_key})
+
+
+def projection_cache_exists(cache_key: str) -> bool:
+    """Returns whether a projection is cached under the given cache key."""
+    return Projection.exists(_cached_projection_path(cache_key))
+
+
+def _cached_projection(
+    cache_key: str | None, compute: Callable[[], Projection]
+) -> Projection:
+    if cache_key is None:
+        return compute()
+    cpath = _cached_projection_path(cache_key)
+    if Projection.exists(cpath):
+        logger.info("Using cached projection for cache key %s", cache_key)
+        return Projection.load(cpath)
+    result = compute()
+    Projection.save(cpath, result)
+    return result
 
 
 def _projection_for_texts(
@@ -93,123 +733,518 @@ def _projection_for_texts(
     model: str | None = None,
     trust_remote_code: bool = False,
     batch_size: int | None = None,
+    max_tokens_per_batch: int | None = None,
+    embedding_workers: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
     umap_args: dict = {},
+    knn_engine: KNNEngine = "auto",
+    fit_sample: int | None = None,
+    workers: int | None = None,
+    pca_dims: int | None = None,
 ) -> Projection:
     if model is None:
         model = "all-MiniLM-L6-v2"
-    hasher = Hasher()
-    hasher.update(
+    keys = EmbeddingStore.keys_for_texts(texts)
+    embeddings_digest = _digest(
         {
-            "version": 1,
-            "texts": texts,
+            "version": 3,
+            "texts": b"".join(keys),
             "model": model,
-            "batch_size": batch_size,
-            "umap_args": umap_args,
+            "backend": embedding_backend,
         }
     )
-    digest = hasher.hexdigest()
-    cpath = cache_path("projections") / digest
 
-    if Projection.exists(cpath):
-        logger.info("Using cached projection from %s", str(cpath))
-        return Projection.load(cpath)
+    return _run_umap(
+        lambda: _embeddings_for_texts(
+            texts,
+            keys,
+            model=model,
+            trust_remote_code=trust_remote_code,
+            batch_size=batch_size,
+            max_tokens_per_batch=max_tokens_per_batch,
+            embedding_workers=embedding_workers,
+            embedding_backend=embedding_backend,
+        ),
+        embeddings_digest,
+        len(texts),
+        umap_args,
+        knn_engine,
+        fit_sample,
+        workers,
+        pca_dims,
+    )
 
-    # Import on demand.
-    from sentence_transformers import SentenceTransformer
+
+def _embeddings_for_texts(
+    texts: list[str],
+    keys: list[bytes],
+    model: str,
+    trust_remote_code: bool = False,
+    batch_size: int | None = None,
+    max_tokens_per_batch: int | None = None,
+    embedding_workers: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
+) -> np.ndarray:
+    _log_deduplication("texts", len(keys), len(set(keys)))
+
+    # Only rows whose text is not in the store go through the model.
+    store = EmbeddingStore.open("text", model=model, backend=embedding_backend)
+    found, stored_vectors = store.lookup(keys)
+    missing = np.flatnonzero(~found)
+
+    if len(missing) == 0:
+        logger.info("Using cached embeddings for all %d texts", len(texts))
+        store.close()
+        assert stored_vectors is not None
+        return stored_vectors
+
+    # Each distinct missing text is embedded once.
+    first_rows: dict[bytes, int] = {}
+    for i in missing:
+        first_rows.setdefault(keys[i], int(i))
+    missing_rows = list(first_rows.values())
+    logger.info(
+        "Found cached embeddings for %d of %d texts, %d unique texts to embed",
+        len(texts) - len(missing),
+        len(texts),
+        len(missing_rows),
+    )
 
     # Set default batch size if not provided
-    if batch_size is None:
+    if batch_size is None and max_tokens_per_batch is None:
         batch_size = 32
         logger.info("Using default batch size of %d for text. Adjust with --batch-size if you encounter memory issues or want to speed up processing.", batch_size)
 
-    logger.info("Loading model %s...", model)
-    transformer = SentenceTransformer(model, trust_remote_code=trust_remote_code)
+    fresh_texts = [texts[i] for i in missing_rows]
+    fresh_keys = [keys[i] for i in missing_rows]
+    if embedding_workers is not None and embedding_workers > 1:
+        chunks = _encode_texts_in_workers(
+            model,
+            trust_remote_code,
+            embedding_backend,
+            fresh_texts,
+            batch_size=batch_size,
+            max_tokens_per_batch=max_tokens_per_batch,
+            workers=embedding_workers,
+        )
+    else:
+        logger.info("Loading model %s...", model)
+        transformer = _load_sentence_transformer(
+            model, trust_remote_code=trust_remote_code, backend=embedding_backend
+        )
+        chunks = (
+            _encode_texts(
+                transformer,
+                fresh_texts[i : i + _text_checkpoint_size],
+                batch_size=batch_size,
+                max_tokens_per_batch=max_tokens_per_batch,
+                show_progress_bar=False,
+            )
+            for i in range(0, len(fresh_texts), _text_checkpoint_size)
+        )
 
-    logger.info("Running embedding for %d texts with batch size %d...", len(texts), batch_size)
-    hidden_vectors = transformer.encode(texts, batch_size=batch_size)
+    if max_tokens_per_batch is not None:
+        logger.info("Running embedding for %d texts with at most %d tokens per batch...", len(fresh_texts), max_tokens_per_batch)
+    else:
+        logger.info("Running embedding for %d texts with batch size %d...", len(fresh_texts), batch_size)
 
-    result = _run_umap(hidden_vectors, umap_args)
-    Projection.save(cpath, result)
+    # Each chunk is stored as soon as it is done, so an interrupted run resumes
+    # from the store. Rows with the same text are filled in from the same vector.
+    import tqdm
+
+    fresh_index = {key: i for i, key in enumerate(fresh_keys)}
+    slots = np.array([fresh_index[keys[i]] for i in missing], dtype=np.int64)
+    order = np.argsort(slots, kind="stable")
+    sorted_slots = slots[order]
+    hidden_vectors = None
+    start = 0
+    try:
+        with tqdm.tqdm(total=len(fresh_texts), smoothing=0.1) as progress:
+            for vectors in chunks:
+                end = start + len(vectors)
+                store.insert(fresh_keys[start:end], vectors)
+                if hidden_vectors is None:
+                    hidden_vectors = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                lo, hi = np.searchsorted(sorted_slots, [start, end])
+                hidden_vectors[missing[order[lo:hi]]] = vectors[sorted_slots[lo:hi] - start]
+                start = end
+                progress.update(len(vectors))
+    finally:
+        store.close()
+
+    assert hidden_vectors is not None
+    if stored_vectors is not None:
+        hidden_vectors[found] = stored_vectors
+    return hidden_vectors
+
+
+# Number of texts embedded between two writes to the embedding store.
+_text_checkpoint_size = 8192
+
+
+def _token_lengths(transformer, texts: list[str]) -> np.ndarray:
+    """Returns the number of tokens of each text after truncation."""
+    tokenizer = getattr(transformer, "tokenizer", None)
+    if tokenizer is None:
+        # Not a text model with a tokenizer, use character counts as a proxy.
+        return np.array([len(text) for text in texts])
+    max_length = transformer.max_seq_length
+    lengths = []
+    chunk_size = 10000
+    for i in range(0, len(texts), chunk_size):
+        result = tokenizer(
+            texts[i : i + chunk_size],
+            truncation=True,
+            max_length=max_length,
+            return_length=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        lengths.extend(result["length"])
+    return np.array(lengths)
+
+
+def _token_budget_batches(
+    lengths: np.ndarray, max_tokens: int, max_batch_size: int | None = None
+) -> list[np.ndarray]:
+    """Groups items of similar lengths into batches, such that each batch,
+    padded to its longest item, has at most max_tokens tokens.
+
+    Returns the batches as arrays of indices into lengths, longest first.
+    """
+    order = np.argsort(-lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        # The first item of each batch is the longest one.
+        size = max(1, max_tokens // max(1, int(lengths[order[start]])))
+        if max_batch_size is not None:
+            size = min(size, max_batch_size)
+        batches.append(order[start : start + size])
+        start += size
+    return batches
+
+
+def _encode_texts(
+    transformer,
+    texts: list[str],
+    batch_size: int | None = None,
+    max_tokens_per_batch: int | None = None,
+    show_progress_bar: bool | None = None,
+) -> np.ndarray:
+    if max_tokens_per_batch is None:
+        assert batch_size is not None
+        return transformer.encode(
+            texts, batch_size=batch_size, show_progress_bar=show_progress_bar
+        )
+
+    # Size batches by a token budget instead of a row count, so that short
+    # texts are not padded to the length of long ones.
+    import tqdm
+
+    lengths = _token_lengths(transformer, texts)
+    batches = _token_budget_batches(lengths, max_tokens_per_batch, batch_size)
+    result = None
+    with tqdm.tqdm(
+        total=len(texts), smoothing=0.1, disable=show_progress_bar is False
+    ) as progress:
+        for batch in batches:
+            vectors = transformer.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+            )
+            if result is None:
+                result = np.empty((len(texts), vectors.shape[1]), dtype=vectors.dtype)
+            result[batch] = vectors
+            progress.update(len(batch))
+    assert result is not None
     return result
 
 
+# The model of an embedding worker process.
+_worker_transformer = None
+
+
+def _init_embedding_worker(
+    model: str,
+    trust_remote_code: bool,
+    backend: EmbeddingBackend,
+    num_threads: int,
+):
+    global _worker_transformer
+
+    import torch
+
+    torch.set_num_threads(num_threads)
+    _worker_transformer = _load_sentence_transformer(
+        model, trust_remote_code=trust_remote_code, backend=backend, device="cpu"
+    )
+
+
+def _encode_in_worker(args: tuple) -> np.ndarray:
+    texts, batch_size, max_tokens_per_batch = args
+    return _encode_texts(
+        _worker_transformer,
+        texts,
+        batch_size=batch_size,
+        max_tokens_per_batch=max_tokens_per_batch,
+        show_progress_bar=False,
+    )
+
+
+def _encode_texts_in_workers(
+    model: str,
+    trust_remote_code: bool,
+    backend: EmbeddingBackend,
+    texts: list[str],
+    batch_size: int | None,
+    max_tokens_per_batch: int | None,
+    workers: int,
+) -> Iterator[np.ndarray]:
+    """Encodes texts on a pool of CPU worker processes, each with its own copy
+    of the model and an equal share of the CPU threads. Yields the vectors of
+    consecutive chunks of texts, in order."""
+    import multiprocessing
+
+    if backend != "torch":
+        # Export the model here, rather than in every worker at the same time.
+        _export_sentence_transformer(model, trust_remote_code, backend, device="cpu")
+
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    chunk_size = 2048
+    chunks = [
+        (texts[i : i + chunk_size], batch_size, max_tokens_per_batch)
+        for i in range(0, len(texts), chunk_size)
+    ]
+    logger.info(
+        "Starting %d embedding worker processes with %d threads each...",
+        workers,
+        num_threads,
+    )
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+        workers,
+        initializer=_init_embedding_worker,
+        initargs=(model, trust_remote_code, backend, num_threads),
+    ) as pool:
+        # Chunks are returned in order as they complete.
+        yield from pool.imap(_encode_in_worker, chunks)
+
+
 def _projection_for_images(
     images: list,
     model: str | None = None,
     trust_remote_code: bool = False,
     batch_size: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
     umap_args: dict = {},
+    knn_engine: KNNEngine = "auto",
+    fit_sample: int | None = None,
+    workers: int | None = None,
+    pca_dims: int | None = None,
 ) -> Projection:
     if model is None:
         model = "google/vit-base-patch16-384"
-    hasher = Hasher()
-    hasher.update(
-        {
-            "version": 1,
-            "images": images,
-            "model": model,
-            "batch_size": batch_size,
-            "umap_args": umap_args,
-        }
+    embeddings_digest = _image_embeddings_digest(images, model, embedding_backend)
+
+    return _run_umap(
+        lambda: _embeddings_for_images(
+            images,
+            embeddings_digest,
+            model=model,
+            batch_size=batch_size,
+            embedding_backend=embedding_backend,
+        ),
+        embeddings_digest,
+        len(images),
+        umap_args,
+        knn_engine,
+        fit_sample,
+        workers,
+        pca_dims,
     )
-    digest = hasher.hexdigest()
-    cpath = cache_path("projections") / (digest + ".npy")
 
-    if Projection.exists(cpath):
-        logger.info("Using cached projection from %s", str(cpath))
-        return Projection.load(cpath)
+
+def _image_embeddings_digest(
+    images: list, model: str, embedding_backend: EmbeddingBackend
+) -> str:
+    return _digest(
+        {"version": 4, "images": images, "model": model, "backend": embedding_backend}
+    )
+
+
+# Number of images embedded between two checkpoint commits.
+_image_checkpoint_size = 1024
+
+
+def _embeddings_for_images(
+    images: list,
+    digest: str,
+    model: str,
+    batch_size: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
+) -> np.ndarray:
+    # Each distinct image is embedded once. The cached embeddings are those of
+    # the distinct images, in order of first occurrence.
+    first, inverse = _deduplicate([_image_bytes(value) for value in images])
+    _log_deduplication("images", len(images), len(first))
+
+    cpath = cache_path("embeddings") / digest
+    if Embeddings.exists(cpath):
+        logger.info("Using cached embeddings from %s", str(cpath))
+        vectors = Embeddings.load(cpath).vectors
+    else:
+        vectors = _embed_images(
+            [images[i] for i in first],
+            cpath,
+            model=model,
+            batch_size=batch_size,
+            embedding_backend=embedding_backend,
+        )
+    return vectors[inverse] if len(first) < len(images) else vectors
+
+
+def _image_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    elif isinstance(value, dict) and "bytes" in value:
+        return value["bytes"]
+    else:
+        raise ValueError("invalid image value")
+
+
+def _embed_images(
+    images: list,
+    cpath: Path,
+    model: str,
+    batch_size: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
+) -> np.ndarray:
 
     # Import on demand.
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
     from io import BytesIO
 
     import torch
     import tqdm
     from PIL import Image
-    from transformers import pipeline
 
     def load_image(value):
-        if isinstance(value, bytes):
-            return Image.open(BytesIO(value)).convert("RGB")
-        elif isinstance(value, dict) and "bytes" in value:
-            return Image.open(BytesIO(value["bytes"])).convert("RGB")
-        else:
-            raise ValueError("invalid image value")
+        return Image.open(BytesIO(_image_bytes(value))).convert("RGB")
 
     logger.info("Loading model %s...", model)
 
-    pipe = pipeline("image-feature-extraction", model=model, device_map="auto")
+    image_processor, forward = _load_image_model(model, embedding_backend)
 
     # Set default batch size if not provided
     if batch_size is None:
         batch_size = 16
         logger.info("Using default batch size of %d for images. Adjust with --batch-size if you encounter memory issues or want to speed up processing.", batch_size)
-    
-    logger.info("Running embedding for %d images with batch size %d...", len(images), batch_size)
-    tensors = []
 
-    current_batch = []
+    def preprocess(batch: list):
+        # Decode, convert, resize and normalize a batch, on a worker thread.
+        return image_processor(  # type: ignore
+            images=[load_image(value) for value in batch], return_tensors="pt"
+        )
 
     @torch.no_grad()
-    def process_batch():
-        rs: torch.Tensor = pipe(current_batch, return_tensors=True)  # type: ignore
-        current_batch.clear()
-        for r in rs:
-            if len(r.shape) == 3:
-                r = r.mean(1)
-            assert len(r.shape) == 2
-            tensors.append(r)
-
-    for image in tqdm.tqdm(images, smoothing=0.1):
-        current_batch.append(load_image(image))
-        if len(current_batch) >= batch_size:
-            process_batch()
-    process_batch()
-
-    hidden_vectors = torch.concat(tensors).to(torch.float32).cpu().numpy()
-
-    result = _run_umap(hidden_vectors, umap_args)
-    Projection.save(cpath, result)
-    return result
+    def process_batch(inputs) -> np.ndarray:
+        r = forward(dict(inputs))
+        if len(r.shape) == 3:
+            r = r.mean(1)
+        assert len(r.shape) == 2
+        return r.to(torch.float32).cpu().numpy()
+
+    # Vectors are written to a memory-mapped checkpoint as they are computed,
+    # so an interrupted run resumes after the last committed batch.
+    checkpoint = _EmbeddingCheckpoint(cpath, len(images))
+    if checkpoint.completed > 0:
+        logger.info("Resuming embedding from image %d of %d", checkpoint.completed, len(images))
+
+    logger.info("Running embedding for %d images with batch size %d...", len(images) - checkpoint.completed, batch_size)
+
+    # Batches are preprocessed ahead on a thread pool, while the model runs on
+    # the current batch. At most `prefetch` batches are in flight.
+    num_workers = min(8, os.cpu_count() or 1)
+    prefetch = 2 * num_workers
+    starts = iter(range(checkpoint.completed, len(images), batch_size))
+    last_commit = checkpoint.completed
+
+    with (
+        ThreadPoolExecutor(num_workers) as executor,
+        tqdm.tqdm(
+            initial=checkpoint.completed, total=len(images), smoothing=0.1
+        ) as progress,
+    ):
+        pending = deque()
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                batch = images[start : start + batch_size]
+                pending.append((start, executor.submit(preprocess, batch)))
+
+        for _ in range(prefetch):
+            submit_next()
+        while len(pending) > 0:
+            start, future = pending.popleft()
+            submit_next()
+            result = process_batch(future.result())
+            checkpoint.write(start, result)
+            end = start + len(result)
+            if end - last_commit >= _image_checkpoint_size or end == len(images):
+                checkpoint.commit(end)
+                last_commit = end
+            progress.update(len(result))
+
+    return checkpoint.finish()
+
+
+def neighbors_column(
+    indices: np.ndarray, distances: np.ndarray
+) -> pd.arrays.ArrowExtensionArray:
+    """
+    Build a neighbors column from a kNN graph, without creating Python objects
+    per row.
+
+    Args:
+        indices: array with shape (N, k), the row ids of the neighbors of each row,
+            sorted by distance.
+        distances: array with shape (N, k), the corresponding distances.
+
+    Returns:
+        An Arrow-backed array of structs with fields "distances" and "ids", which
+        are fixed-size lists of k float32 distances and int32 ids (or empty lists
+        if k is 0, e.g., before the neighbors are computed).
+    """
+    k = indices.shape[1]
+    if k == 0:
+        # Arrow has no fixed-size lists of size 0.
+        offsets = pa.array(np.zeros(len(indices) + 1, dtype=np.int32))
+        ids = pa.ListArray.from_arrays(offsets, pa.array([], type=pa.int32()))
+        dists = pa.ListArray.from_arrays(offsets, pa.array([], type=pa.float32()))
+        return pd.arrays.ArrowExtensionArray(
+            pa.StructArray.from_arrays([dists, ids], names=["distances", "ids"])
+        )
+    ids = pa.FixedSizeListArray.from_arrays(
+        pa.array(np.ascontiguousarray(indices, dtype=np.int32).reshape(-1)), k
+    )
+    dists = pa.FixedSizeListArray.from_arrays(
+        pa.array(np.ascontiguousarray(distances, dtype=np.float32).reshape(-1)), k
+    )
+    return pd.arrays.ArrowExtensionArray(
+        pa.StructArray.from_arrays([dists, ids], names=["distances", "ids"])
+    )
+
+
+def empty_neighbors_column(count: int) -> pd.arrays.ArrowExtensionArray:
+    """A neighbors column (see neighbors_column) with no neighbors for each of
+    `count` rows."""
+    return neighbors_column(
+        np.zeros((count, 0), dtype=np.int32), np.zeros((count, 0), dtype=np.float32)
+    )
 
 
 def compute_text_projection(
@@ -221,7 +1256,15 @@ def compute_text_projection(
     model: str | None = None,
     trust_remote_code: bool = False,
     batch_size: int | None = None,
+    max_tokens_per_batch: int | None = None,
+    embedding_workers: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
     umap_args: dict = {},
+    knn_engine: KNNEngine = "auto",
+    projection_fit_sample: int | None = None,
+    projection_workers: int | None = None,
+    pca_dims: int | None = None,
+    cache_key: str | None = None,
 ):
     """
     Compute text embeddings and generate 2D projections using UMAP.
@@ -241,37 +1284,180 @@ def compute_text_projection(
             the model from HuggingFace Hub. Default is False.
         batch_size: int, batch size for processing embeddings. Larger values use more 
             memory but may be faster. Default is 32.
+        max_tokens_per_batch: int, if specified, texts are grouped by token length and
+            batches are sized so that each has at most this many tokens including
+            padding, instead of a fixed number of rows. `batch_size` then only caps
+            the number of rows in a batch.
+        embedding_workers: int, if greater than 1, the number of CPU worker processes
+            to run the embedding model on. Each worker loads its own copy of the model.
+        embedding_backend: str, the inference backend for the embedding model: "torch"
+            (default), "onnx", or "onnx-int8" (ONNX Runtime with dynamic int8
+            quantization). ONNX models are exported once and cached. The ONNX
+            backends require the optimum package with onnxruntime.
         umap_args: dict, additional keyword arguments to pass to the UMAP algorithm
             (e.g., n_neighbors, min_dist, metric).
+        knn_engine: str, the engine for the k-nearest-neighbor graph: "exact" (blocked
+            brute-force search), "nndescent" (approximate, as in UMAP), or "auto"
+            (default), which uses "exact" for up to 50,000 rows with the cosine or
+            euclidean metric, and "nndescent" otherwise.
+        projection_fit_sample: int, if given and smaller than the number of rows, UMAP
+            is fitted on a random sample of this many rows, and the other rows are
+            placed with UMAP's transform, in chunks. This bounds the time and memory
+            of the layout for very large datasets. The neighbors are still computed
+            on all rows.
+        projection_workers: int, if greater than 1, the number of processes to place
+            the rows outside the fit sample on.
+        pca_dims: int, if given, the embeddings are reduced to this many dimensions
+            with randomized PCA before the nearest neighbors and UMAP, which speeds
+            up both for high-dimensional embeddings. The reduced embeddings are cached.
+        cache_key: str, an optional key that identifies the input data and settings,
+            such as a digest of input file fingerprints. If given, the projection is
+            cached under this key, and the input column is neither read nor hashed
+            when the cached projection exists. The key must change whenever the
+            input data or any setting changes.
 
     Returns:
         The input DataFrame with added columns for X, Y coordinates and nearest neighbors.
     """
 
-    text_series = data_frame[text].astype(str).fillna("")
-    proj = _projection_for_texts(
-        list(text_series),
-        model=model,
-        trust_remote_code=trust_remote_code,
-        batch_size=batch_size,
-        umap_args=umap_args,
-    )
+    def compute():
+        text_series = data_frame[text].astype(str).fillna("")
+        return _projection_for_texts(
+            list(text_series),
+            model=model,
+            trust_remote_code=trust_remote_code,
+            batch_size=batch_size,
+            max_tokens_per_batch=max_tokens_per_batch,
+            embedding_workers=embedding_workers,
+            embedding_backend=embedding_backend,
+            umap_args=umap_args,
+            knn_engine=knn_engine,
+            fit_sample=projection_fit_sample,
+            workers=projection_workers,
+            pca_dims=pca_dims,
+        )
+
+    proj = _cached_projection(cache_key, compute)
     data_frame[x] = proj.projection[:, 0]
     data_frame[y] = proj.projection[:, 1]
     if neighbors is not None:
-        data_frame[neighbors] = [
-            {"distances": b, "ids": a}  # ID is always the same as the row index.
-            for a, b in zip(proj.knn_indices, proj.knn_distances)
-        ]
+        # ID is always the same as the row index.
+        data_frame[neighbors] = neighbors_column(proj.knn_indices, proj.knn_distances)
+
+
+def load_vector_file(path: str | Path) -> np.ndarray:
+    """
+    Memory-map a matrix of embeddings stored in a .npy file, with one row per
+    data point. The file is read on demand, so it can be larger than memory.
+
+    Args:
+        path: the path of the .npy file, as written by numpy.save.
+
+    Returns:
+        A read-only 2D array backed by the file.
+    """
+    vectors = np.load(path, mmap_mode="r")
+    if vectors.ndim != 2:
+        raise ValueError(
+            f"expected a 2D array of vectors in {path}, got shape {vectors.shape}"
+        )
+    if not np.issubdtype(vectors.dtype, np.number):
+        raise ValueError(f"expected numeric vectors in {path}, got {vectors.dtype}")
+    return vectors
+
+
+def vector_matrix(values) -> np.ndarray:
+    """
+    Convert a column of vectors to a 2D array, without copying the data when
+    possible, and keeping the dtype of the vectors (e.g., float16 or float32).
+
+    Args:
+        values: the vectors, as a 2D numpy array (returned as is), an Arrow
+            FixedSizeList or List array (or ChunkedArray) of equal-length
+            vectors, or a pandas Series or sequence of numpy arrays or lists.
+            Series of numpy arrays that are consecutive views of one buffer, as
+            pandas produces when reading a list column from parquet, are viewed
+            without copying. Lists of Python numbers become float32.
+
+    Returns:
+        A 2D array with one row per vector. It may be read-only.
+    """
+    if isinstance(values, np.ndarray) and values.ndim == 2:
+        return values
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.ArrowDtype):
+        values = values.array.__arrow_array__()  # type: ignore
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        return _arrow_vector_matrix(values)
+
+    items = list(values)
+    if len(items) > 0 and all(isinstance(item, np.ndarray) for item in items):
+        view = _consecutive_view(items)
+        return view if view is not None else np.stack(items)
+    result = np.array(items)
+    if result.dtype == np.float64 and len(items) > 0 and isinstance(items[0], list):
+        result = result.astype(np.float32)
+    return result
+
+
+def _arrow_vector_matrix(values: "pa.Array | pa.ChunkedArray") -> np.ndarray:
+    chunks = values.chunks if isinstance(values, pa.ChunkedArray) else [values]
+    if len(chunks) != 1:
+        # Chunks are separate buffers, so they are copied once.
+        return np.concatenate([_arrow_vector_matrix(c) for c in chunks])
+    array = chunks[0]
+    if array.null_count > 0:
+        raise ValueError("the vector column contains null values")
+    if pa.types.is_fixed_size_list(array.type):
+        dim = array.type.list_size
+    elif pa.types.is_list(array.type) or pa.types.is_large_list(array.type):
+        offsets = array.offsets.to_numpy()
+        lengths = np.diff(offsets)
+        if len(lengths) > 0 and (lengths != lengths[0]).any():
+            raise ValueError("the vectors in the vector column have different lengths")
+        dim = int(lengths[0]) if len(lengths) > 0 else 0
+    else:
+        raise ValueError(f"unsupported vector column type {array.type}")
+    # `flatten` accounts for slicing, and is zero-copy for unsliced arrays.
+    flat = array.flatten().to_numpy(zero_copy_only=False)
+    return flat.reshape(len(array), dim)
+
+
+def _consecutive_view(items: list[np.ndarray]) -> np.ndarray | None:
+    """If the arrays are consecutive slices of one buffer, returns a 2D view
+    of them, otherwise None."""
+    first = items[0]
+    if first.ndim != 1 or first.base is None:
+        return None
+    dtype, dim, base = first.dtype, len(first), first.base
+    step = dim * dtype.itemsize
+    start = first.__array_interface__["data"][0]
+    for i, item in enumerate(items):
+        if (
+            item.base is not base
+            or item.dtype != dtype
+            or item.shape != (dim,)
+            or item.strides != (dtype.itemsize,)
+            or item.__array_interface__["data"][0] != start + i * step
+        ):
+            return None
+    return np.lib.stride_tricks.as_strided(
+        first, shape=(len(items), dim), strides=(step, dtype.itemsize), writeable=False
+    )
 
 
 def compute_vector_projection(
     data_frame: pd.DataFrame,
-    vector: str,
+    vector: str | None,
     x: str = "projection_x",
     y: str = "projection_y",
     neighbors: str | None = "neighbors",
     umap_args: dict = {},
+    knn_engine: KNNEngine = "auto",
+    projection_fit_sample: int | None = None,
+    projection_workers: int | None = None,
+    pca_dims: int | None = None,
+    cache_key: str | None = None,
+    vectors: np.ndarray | None = None,
 ):
     """
     Generate 2D projections from pre-existing vector embeddings using UMAP.
@@ -282,45 +1468,75 @@ def compute_vector_projection(
     Args:
         data_frame: pandas DataFrame containing the vector data to process.
         vector: str, column name containing the pre-computed vector embeddings.
-                Each entry should be a list or numpy array of numbers.
+                Each entry should be a list or numpy array of numbers, or the
+                column can be Arrow-backed (see vector_matrix). None if the
+                vectors are given with `vectors`.
         x: str, column name where the UMAP X coordinates will be stored.
         y: str, column name where the UMAP Y coordinates will be stored.
         neighbors: str, column name where the nearest neighbor indices will be stored.
         umap_args: dict, additional keyword arguments to pass to the UMAP algorithm
             (e.g., n_neighbors, min_dist, metric).
+        knn_engine: str, the engine for the k-nearest-neighbor graph: "exact" (blocked
+            brute-force search), "nndescent" (approximate, as in UMAP), or "auto"
+            (default), which uses "exact" for up to 50,000 rows with the cosine or
+            euclidean metric, and "nndescent" otherwise.
+        projection_fit_sample: int, if given and smaller than the number of rows, UMAP
+            is fitted on a random sample of this many rows, and the other rows are
+            placed with UMAP's transform, in chunks. This bounds the time and memory
+            of the layout for very large datasets. The neighbors are still computed
+            on all rows.
+        projection_workers: int, if greater than 1, the number of processes to place
+            the rows outside the fit sample on.
+        pca_dims: int, if given, the embeddings are reduced to this many dimensions
+            with randomized PCA before the nearest neighbors and UMAP, which speeds
+            up both for high-dimensional embeddings. The reduced embeddings are cached.
+        cache_key: str, an optional key that identifies the input data and settings,
+            such as a digest of input file fingerprints. If given, the projection is
+            cached under this key, and the input column is neither read nor hashed
+            when the cached projection exists. The key must change whenever the
+            input data or any setting changes.
+        vectors: numpy array, the embeddings as a matrix with one row per row of the
+            DataFrame, used instead of the `vector` column. This can be a
+            memory-mapped array (see load_vector_file), which is read as needed
+            and never copied into the DataFrame.
 
     Returns:
         The input DataFrame with added columns for X, Y coordinates and nearest neighbors.
     """
-    # Convert vector column to numpy array
-    vector_series = data_frame[vector]
-
-    # Convert each vector entry to numpy array and stack them
-    vector_list = []
-    for vector in vector_series:
-        if isinstance(vector, list):
-            vector_array = np.array(vector)
-        elif isinstance(vector, np.ndarray):
-            vector_array = vector
+    if (vector is None) == (vectors is None):
+        raise ValueError("exactly one of vector and vectors is required")
+    if vectors is not None and len(vectors) != len(data_frame):
+        raise ValueError(
+            f"the vectors have {len(vectors)} rows, but the data frame has {len(data_frame)}"
+        )
+
+    def compute():
+        if vectors is not None:
+            hidden_vectors = vector_matrix(vectors)
         else:
-            # Try to convert to numpy array
-            vector_array = np.array(vector)
-        vector_list.append(vector_array)
+            hidden_vectors = vector_matrix(data_frame[vector])
 
-    # Stack all vectors into a single numpy array
-    hidden_vectors = np.stack(vector_list)
+        # Run UMAP on the pre-existing vectors
+        embeddings_digest = _digest({"version": 2, "vectors": hidden_vectors})
+        return _run_umap(
+            lambda: hidden_vectors,
+            embeddings_digest,
+            len(hidden_vectors),
+            umap_args,
+            knn_engine,
+            projection_fit_sample,
+            projection_workers,
+            pca_dims,
+        )
 
-    # Run UMAP on the pre-existing vectors
-    proj = _run_umap(hidden_vectors, umap_args)
+    proj = _cached_projection(cache_key, compute)
 
     # Add projection results to dataframe
     data_frame[x] = proj.projection[:, 0]
     data_frame[y] = proj.projection[:, 1]
     if neighbors is not None:
-        data_frame[neighbors] = [
-            {"distances": b, "ids": a}  # ID is always the same as the row index.
-            for a, b in zip(proj.knn_indices, proj.knn_distances)
-        ]
+        # ID is always the same as the row index.
+        data_frame[neighbors] = neighbors_column(proj.knn_indices, proj.knn_distances)
 
 
 def compute_image_projection(
@@ -332,7 +1548,13 @@ def compute_image_projection(
     model: str | None = None,
     trust_remote_code: bool = False,
     batch_size: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
     umap_args: dict = {},
+    knn_engine: KNNEngine = "auto",
+    projection_fit_sample: int | None = None,
+    projection_workers: int | None = None,
+    pca_dims: int | None = None,
+    cache_key: str | None = None,
 ):
     """
     Compute image embeddings and generate 2D projections using UMAP.
@@ -352,25 +1574,487 @@ def compute_image_projection(
             the model from HuggingFace Hub. Default is False.
         batch_size: int, batch size for processing images. Larger values use more 
             memory but may be faster. Default is 16.
+        embedding_backend: str, the inference backend for the embedding model: "torch"
+            (default), "onnx", or "onnx-int8" (ONNX Runtime with dynamic int8
+            quantization). ONNX models are exported once and cached. The ONNX
+            backends require the optimum package with onnxruntime.
         umap_args: dict, additional keyword arguments to pass to the UMAP algorithm
             (e.g., n_neighbors, min_dist, metric).
+        knn_engine: str, the engine for the k-nearest-neighbor graph: "exact" (blocked
+            brute-force search), "nndescent" (approximate, as in UMAP), or "auto"
+            (default), which uses "exact" for up to 50,000 rows with the cosine or
+            euclidean metric, and "nndescent" otherwise.
+        projection_fit_sample: int, if given and smaller than the number of rows, UMAP
+            is fitted on a random sample of this many rows, and the other rows are
+            placed with UMAP's transform, in chunks. This bounds the time and memory
+            of the layout for very large datasets. The neighbors are still computed
+            on all rows.
+        projection_workers: int, if greater than 1, the number of processes to place
+            the rows outside the fit sample on.
+        pca_dims: int, if given, the embeddings are reduced to this many dimensions
+            with randomized PCA before the nearest neighbors and UMAP, which speeds
+            up both for high-dimensional embeddings. The reduced embeddings are cached.
+        cache_key: str, an optional key that identifies the input data and settings,
+            such as a digest of input file fingerprints. If given, the projection is
+            cached under this key, and the input column is neither read nor hashed
+            when the cached projection exists. The key must change whenever the
+            input data or any setting changes.
 
     Returns:
         The input DataFrame with added columns for X, Y coordinates and nearest neighbors.
     """
 
-    image_series = data_frame[image]
-    proj = _projection_for_images(
-        list(image_series),
-        model=model,
-        trust_remote_code=trust_remote_code,
-        batch_size=batch_size,
-        umap_args=umap_args,
-    )
+    def compute():
+        image_series = data_frame[image]
+        return _projection_for_images(
+            list(image_series),
+            model=model,
+            trust_remote_code=trust_remote_code,
+            batch_size=batch_size,
+            embedding_backend=embedding_backend,
+            umap_args=umap_args,
+            knn_engine=knn_engine,
+            fit_sample=projection_fit_sample,
+            workers=projection_workers,
+            pca_dims=pca_dims,
+        )
+
+    proj = _cached_projection(cache_key, compute)
     data_frame[x] = proj.projection[:, 0]
     data_frame[y] = proj.projection[:, 1]
     if neighbors is not None:
-        data_frame[neighbors] = [
-            {"distances": b, "ids": a}  # ID is always the same as the row index.
-            for a, b in zip(proj.knn_indices, proj.knn_distances)
-        ]
+        # ID is always the same as the row index.
+        data_frame[neighbors] = neighbors_column(proj.knn_indices, proj.knn_distances)
+
+
+def _append_to_layout(
+    old_vectors: np.ndarray,
+    new_vectors: np.ndarray,
+    layout: np.ndarray,
+    old_neighbors: pd.Series,
+    umap_args: dict = {},
+) -> tuple[np.ndarray, dict[int, dict], tuple[np.ndarray, np.ndarray]]:
+    """Places new rows into an existing UMAP layout without moving the
+    existing rows, the same way UMAP.transform does.
+
+    Returns the 2D positions of the new rows, the updated neighbor lists of the
+    existing rows that have new rows among their nearest neighbors (by row), and
+    the neighbor indices and distances of the new rows, with shape
+    (new rows, n_neighbors).
+    """
+    from scipy.sparse import coo_matrix
+    from umap.layouts import optimize_layout_euclidean
+    from umap.umap_ import (
+        compute_membership_strengths,
+        find_ab_params,
+        init_graph_transform,
+        make_epochs_per_sample,
+        smooth_knn_dist,
+    )
+
+    from .knn import exact_nearest_neighbors
+
+    metric = umap_args.get("metric", "cosine")
+    n_neighbors = umap_args.get("n_neighbors", 15)
+    old_count = len(old_vectors)
+    all_vectors = np.concatenate([old_vectors, new_vectors]).astype(np.float32)
+
+    # Neighbors of the new rows among the existing rows place them in the
+    # layout, neighbors among all rows go into the neighbors column.
+    indices, distances = exact_nearest_neighbors(
+        old_vectors, n_neighbors, metric, queries=new_vectors
+    )
+    all_indices, all_distances = exact_nearest_neighbors(
+        all_vectors, n_neighbors, metric, queries=new_vectors
+    )
+
+    logger.info("Placing %d new rows into the existing layout...", len(new_vectors))
+    k = indices.shape[1]
+    local_connectivity = umap_args.get("local_connectivity", 1.0)
+    sigmas, rhos = smooth_knn_dist(
+        distances, float(k), local_connectivity=max(0.0, local_connectivity - 1.0)
+    )
+    rows, cols, vals, _ = compute_membership_strengths(
+        indices, distances, sigmas, rhos, bipartite=True
+    )
+    graph = coo_matrix((vals, (rows, cols)), shape=(len(new_vectors), old_count))
+    csr_graph = graph.tocsr()
+    csr_graph.eliminate_zeros()
+    old_layout = np.ascontiguousarray(layout, dtype=np.float32)
+    embedding = init_graph_transform(csr_graph, old_layout)
+
+    n_epochs = umap_args.get("n_epochs")
+    if n_epochs is None:
+        n_epochs = 100 if len(new_vectors) <= 10000 else 30
+    else:
+        n_epochs = int(n_epochs // 3)
+    graph.data[graph.data < (graph.data.max() / float(n_epochs))] = 0.0
+    graph.eliminate_zeros()
+
+    a, b = find_ab_params(umap_args.get("spread", 1.0), umap_args.get("min_dist", 0.1))
+    random_state = np.random.RandomState(umap_args.get("random_state"))
+    embedding = optimize_layout_euclidean(
+        embedding.astype(np.float32),
+        old_layout.copy(),
+        graph.row,
+        graph.col,
+        n_epochs,
+        old_count,
+        make_epochs_per_sample(graph.data, n_epochs),
+        a,
+        b,
+        random_state.randint(np.iinfo(np.int32).min, np.iinfo(np.int32).max, 3).astype(np.int64),
+        umap_args.get("repulsion_strength", 1.0),
+        umap_args.get("learning_rate", 1.0) / 4.0,
+        umap_args.get("negative_sample_rate", 5),
+        umap_args.get("random_state") is None,
+    )
+
+    # kNN is not symmetric: a new row can be among the nearest neighbors of an
+    # existing row that is not among its own. Find the nearest new rows of all
+    # existing rows, and merge them into the lists they improve.
+    new_indices, new_distances = exact_nearest_neighbors(
+        new_vectors, n_neighbors, metric, queries=old_vectors
+    )
+    kth_distances = np.array(
+        [np.asarray(value["distances"])[-1] for value in old_neighbors],
+        dtype=np.float32,
+    )
+    affected = np.flatnonzero(new_distances[:, 0] < kth_distances)
+    updated = {}
+    for row in affected:
+        current = old_neighbors.iloc[row]
+        count = len(current["ids"])
+        merged_ids = np.concatenate(
+            [np.asarray(current["ids"]), new_indices[row] + old_count]
+        )
+        merged_distances = np.concatenate(
+            [np.asarray(current["distances"], dtype=np.float32), new_distances[row]]
+        )
+        order = np.argsort(merged_distances, kind="stable")[:count]
+        updated[int(row)] = {
+            "distances": merged_distances[order],
+            "ids": merged_ids[order],
+        }
+    logger.info("Updated the neighbors of %d existing rows", len(updated))
+
+    return embedding, updated, (all_indices, all_distances)
+
+
+def _appended_data_frame(
+    data_frame: pd.DataFrame,
+    new_data_frame: pd.DataFrame,
+    x: str,
+    y: str,
+    neighbors: str | None,
+    placement: tuple[np.ndarray, dict[int, dict], tuple[np.ndarray, np.ndarray]],
+) -> pd.DataFrame:
+    embedding, updated, (new_indices, new_distances) = placement
+    new_data_frame = new_data_frame.copy()
+    new_data_frame[x] = embedding[:, 0]
+    new_data_frame[y] = embedding[:, 1]
+    result = pd.concat(
+        [data_frame.drop(columns=[neighbors], errors="ignore"), new_data_frame],
+        ignore_index=True,
+    )
+    if neighbors is not None:
+        values = list(data_frame[neighbors])
+        for row, value in updated.items():
+            values[row] = value
+        indices = np.concatenate(
+            [np.stack([np.asarray(v["ids"]) for v in values]), new_indices]
+        )
+        distances = np.concatenate(
+            [np.stack([np.asarray(v["distances"]) for v in values]), new_distances]
+        )
+        result[neighbors] = neighbors_column(indices, distances)
+    return result
+
+
+def append_text_projection(
+    data_frame: pd.DataFrame,
+    new_data_frame: pd.DataFrame,
+    text: str,
+    x: str = "projection_x",
+    y: str = "projection_y",
+    neighbors: str = "neighbors",
+    model: str | None = None,
+    trust_remote_code: bool = False,
+    batch_size: int | None = None,
+    max_tokens_per_batch: int | None = None,
+    embedding_workers: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
+    umap_args: dict = {},
+) -> pd.DataFrame:
+    """
+    Append rows to a data frame that already has a text projection, placing the
+    new rows into the existing layout without moving the existing rows.
+
+    The existing rows are not embedded again if their embeddings are cached, and
+    the nearest neighbors of existing rows are updated to include new rows that
+    are closer than their current neighbors. Use this to add new data to a map
+    without recomputing it. Only the cosine and euclidean metrics are supported.
+
+    Args:
+        data_frame: pandas DataFrame with the existing rows, including the X, Y
+            coordinates and nearest neighbors from a previous projection.
+        new_data_frame: pandas DataFrame with the rows to append.
+        text: str, column name containing the text data to embed.
+        x: str, column name of the X coordinates.
+        y: str, column name of the Y coordinates.
+        neighbors: str, column name of the nearest neighbors.
+        model: str, name or path of the SentenceTransformer model used for the
+            existing projection.
+        trust_remote_code: bool, whether to trust and execute remote code when loading
+            the model from HuggingFace Hub.
+        batch_size: int, batch size for processing embeddings.
+        max_tokens_per_batch: int, if given, texts are sorted by length and batched by
+            a budget of tokens per batch.
+        embedding_workers: int, if greater than 1, the number of CPU worker processes
+            to run the embedding model on.
+        embedding_backend: str, the inference backend for the embedding model.
+        umap_args: dict, the UMAP arguments used for the existing projection.
+
+    Returns:
+        A new DataFrame with the existing rows followed by the new rows.
+    """
+    if model is None:
+        model = "all-MiniLM-L6-v2"
+
+    def embed(frame: pd.DataFrame) -> np.ndarray:
+        texts = list(frame[text].astype(str).fillna(""))
+        return _embeddings_for_texts(
+            texts,
+            EmbeddingStore.keys_for_texts(texts),
+            model=model,
+            trust_remote_code=trust_remote_code,
+            batch_size=batch_size,
+            max_tokens_per_batch=max_tokens_per_batch,
+            embedding_workers=embedding_workers,
+            embedding_backend=embedding_backend,
+        )
+
+    placement = _append_to_layout(
+        embed(data_frame),
+        embed(new_data_frame),
+        data_frame[[x, y]].to_numpy(),
+        data_frame[neighbors],
+        umap_args,
+    )
+    return _appended_data_frame(data_frame, new_data_frame, x, y, neighbors, placement)
+
+
+def append_vector_projection(
+    data_frame: pd.DataFrame,
+    new_data_frame: pd.DataFrame,
+    vector: str,
+    x: str = "projection_x",
+    y: str = "projection_y",
+    neighbors: str = "neighbors",
+    umap_args: dict = {},
+) -> pd.DataFrame:
+    """
+    Append rows to a data frame that already has a projection of pre-computed
+    vectors, placing the new rows into the existing layout without moving the
+    existing rows. See append_text_projection.
+
+    Args:
+        data_frame: pandas DataFrame with the existing rows, including the X, Y
+            coordinates and nearest neighbors from a previous projection.
+        new_data_frame: pandas DataFrame with the rows to append.
+        vector: str, column name containing the pre-computed vector embeddings.
+        x: str, column name of the X coordinates.
+        y: str, column name of the Y coordinates.
+        neighbors: str, column name of the nearest neighbors.
+        umap_args: dict, the UMAP arguments used for the existing projection.
+
+    Returns:
+        A new DataFrame with the existing rows followed by the new rows.
+    """
+    placement = _append_to_layout(
+        vector_matrix(data_frame[vector]),
+        vector_matrix(new_data_frame[vector]),
+        data_frame[[x, y]].to_numpy(),
+        data_frame[neighbors],
+        umap_args,
+    )
+    return _appended_data_frame(data_frame, new_data_frame, x, y, neighbors, placement)
+
+
+def append_image_projection(
+    data_frame: pd.DataFrame,
+    new_data_frame: pd.DataFrame,
+    image: str,
+    x: str = "projection_x",
+    y: str = "projection_y",
+    neighbors: str = "neighbors",
+    model: str | None = None,
+    trust_remote_code: bool = False,
+    batch_size: int | None = None,
+    embedding_backend: EmbeddingBackend = "torch",
+    umap_args: dict = {},
+) -> pd.DataFrame:
+    """
+    Append rows to a data frame that already has an image projection, placing
+    the new rows into the existing layout without moving the existing rows.
+    See append_text_projection.
+
+    Args:
+        data_frame: pandas DataFrame with the existing rows, including the X, Y
+            coordinates and nearest neighbors from a previous projection.
+        new_data_frame: pandas DataFrame with the rows to append.
+        image: str, column name containing the image data.
+        x: str, column name of the X coordinates.
+        y: str, column name of the Y coordinates.
+        neighbors: str, column name of the nearest neighbors.
+        model: str, name or path of the model used for the existing projection.
+        trust_remote_code: bool, whether to trust and execute remote code when loading
+            the model from HuggingFace Hub.
+        batch_size: int, batch size for processing images.
+        embedding_backend: str, the inference backend for the embedding model.
+        umap_args: dict, the UMAP arguments used for the existing projection.
+
+    Returns:
+        A new DataFrame with the existing rows followed by the new rows.
+    """
+    if model is None:
+        model = "google/vit-base-patch16-384"
+
+    def embed(images: list) -> np.ndarray:
+        return _embeddings_for_images(
+            images,
+            _image_embeddings_digest(images, model, embedding_backend),
+            model=model,
+            batch_size=batch_size,
+            embedding_backend=embedding_backend,
+        )
+
+    old_images = list(data_frame[image])
+    new_images = list(new_data_frame[image])
+    old_vectors = embed(old_images)
+    new_vectors = embed(new_images)
+
+    # Cache the embeddings of all rows, so that a later append to the result
+    # does not embed them again.
+    all_images = old_images + new_images
+    all_path = cache_path("embeddings") / _image_embeddings_digest(
+        all_images, model, embedding_backend
+    )
+    if not Embeddings.exists(all_path):
+        first, _ = _deduplicate([_image_bytes(value) for value in all_images])
+        all_vectors = np.concatenate([old_vectors, new_vectors])
+        Embeddings.save(all_path, Embeddings(vectors=all_vectors[first]))
+
+    placement = _append_to_layout(
+        old_vectors,
+        new_vectors,
+        data_frame[[x, y]].to_numpy(),
+        data_frame[neighbors],
+        umap_args,
+    )
+    return _appended_data_frame(data_frame, new_data_frame, x, y, neighbors, placement)
+
+
+# The number of rows the preview layout is fitted on, and the number of rows
+# whose features are computed at a time to place all rows.
+PREVIEW_FIT_ROWS = 20_000
+PREVIEW_CHUNK_ROWS = 8192
+
+
+def compute_preview_projection(
+    data_frame: pd.DataFrame,
+    x: str = "projection_x",
+    y: str = "projection_y",
+    text: str | None = None,
+    image: str | None = None,
+    vector: str | None = None,
+    vectors: np.ndarray | None = None,
+):
+    """
+    Generate a quick preview layout, to show while the full projection runs.
+
+    The preview is a 2D PCA of features that are cheap to compute: the vectors
+    themselves for a vector column, hashed word counts for a text column, and
+    downsampled grayscale pixels for an image column. The PCA is fitted on a
+    sample of rows, and the features of all rows are computed one chunk at a
+    time. It takes seconds where the embedding model and UMAP can take hours,
+    but only shows coarse structure.
+
+    Args:
+        data_frame: pandas DataFrame containing the data to process.
+        x: str, column name where the X coordinates will be stored.
+        y: str, column name where the Y coordinates will be stored.
+        text: str, column name containing text data.
+        image: str, column name containing image data.
+        vector: str, column name containing pre-computed vector embeddings.
+        vectors: numpy array, pre-computed vector embeddings with one row per row of
+            the DataFrame, used instead of a column.
+    """
+    from contextlib import ExitStack
+
+    from scipy.sparse import issparse
+
+    from .pca import principal_components
+
+    # Resources of the features, released at the end.
+    stack = ExitStack()
+
+    # features(rows) returns the features of the rows at the given positions,
+    # as a dense or sparse matrix.
+    if vectors is not None or vector is not None:
+        matrix = vectors if vectors is not None else vector_matrix(data_frame[vector])
+
+        def features(rows: np.ndarray):
+            return np.asarray(matrix[rows], dtype=np.float32)
+
+    elif text is not None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        vectorizer = HashingVectorizer(n_features=1024, alternate_sign=False)
+        texts = data_frame[text]
+
+        def features(rows: np.ndarray):
+            # Sparse, at most a few hundred nonzeros per row.
+            return vectorizer.transform(texts.iloc[rows].astype(str).fillna(""))
+
+    elif image is not None:
+        from concurrent.futures import ThreadPoolExecutor
+        from io import BytesIO
+
+        from PIL import Image
+
+        images = data_frame[image]
+        executor = stack.enter_context(ThreadPoolExecutor())
+
+        def pixels(value) -> np.ndarray:
+            image = Image.open(BytesIO(_image_bytes(value)))
+            image.draft("L", (32, 32))
+            return np.asarray(image.convert("L").resize((16, 16)), dtype=np.float32)
+
+        def features(rows: np.ndarray):
+            # Decoding releases the GIL, so the images are decoded in parallel.
+            return np.stack([p.ravel() for p in executor.map(pixels, images.iloc[rows])])
+
+    else:
+        raise ValueError("one of text, image, or vector is required")
+
+    # The components are fitted on a sample, then all rows are placed one
+    # chunk at a time, so only a chunk of features is ever in memory.
+    count = len(data_frame)
+    with stack:
+        rng = np.random.default_rng(0)
+        sample = np.sort(
+            rng.choice(count, min(count, PREVIEW_FIT_ROWS), replace=False)
+        )
+        sample_features = features(sample)
+        if issparse(sample_features):
+            sample_features = sample_features.toarray()  # type: ignore
+        mean, components = principal_components(sample_features, 2)
+        offset = mean @ components.T
+
+        layout = np.empty((count, len(components)), dtype=np.float32)
+        for start in range(0, count, PREVIEW_CHUNK_ROWS):
+            rows = np.arange(start, min(start + PREVIEW_CHUNK_ROWS, count))
+            layout[rows] = features(rows) @ components.T - offset
+    data_frame[x] = layout[:, 0]
+    data_frame[y] = layout[:, 1]
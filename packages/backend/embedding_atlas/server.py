@@ -1,31 +1,57 @@
 # Copyright (c) 2025 Apple Inc. Licensed under MIT License.
 
 import asyncio
+import atexit
 import concurrent.futures
+import hashlib
+import itertools
 import json
 import os
 import re
+import struct
+import threading
 import uuid
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
 from functools import lru_cache
+from pathlib import Path
 from typing import Callable
 
 import duckdb
+import pandas as pd
 import pyarrow as pa
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from .data_source import DataSource
-from .utils import to_parquet_bytes
+from .data_source import LAYOUT_FILES, NEIGHBORS_SIDECAR, DataSource
+from .utils import Hasher, cache_path, logger
 
 
 def make_server(
     data_source: DataSource,
     static_path: str,
     duckdb_uri: str | None = None,
+    duckdb_path: Path | None = None,
+    query_cache_bytes: int = 0,
+    query_cache_directory: Path | None = None,
 ):
-    """Creates a server for hosting Embedding Atlas"""
+    """Creates a server for hosting Embedding Atlas
+
+    Args:
+        data_source: The dataset to serve.
+        static_path: The directory of the frontend's static files.
+        duckdb_uri: Where queries run: "wasm" (in the browser), "server", or
+            the URI of another DuckDB server.
+        duckdb_path: With duckdb_uri="server", a database file to keep the
+            dataset in, which is reused on restart while the dataset is the
+            same. If None, the database is in memory.
+        query_cache_bytes: The memory budget of the query result cache, in
+            bytes; 0 disables the cache.
+        query_cache_directory: A directory for the query cache to keep results
+            in across restarts, specific to the dataset.
+    """
 
     app = FastAPI()
     app.add_middleware(
@@ -36,13 +62,59 @@ def make_server(
         expose_headers=["*"],
     )
 
-    mount_bytes(
+    # The browser loads the files of the layout, if there is one, unless the
+    # queries run on this server, and dataset.parquet otherwise (or to
+    # download it). The files are written on first request, or right away if
+    # the browser will request them.
+    served_path = cache_path("served", data_source.identifier)
+    load_files = duckdb_uri != "server"
+    refresh_dataset_files = [
+        mount_file(
+            app,
+            "/data/dataset.parquet",
+            "application/octet-stream",
+            served_path,
+            data_source.write_parquet,
+            eager=load_files and data_source.layout is None,
+        )
+    ]
+    for part, spec in (data_source.layout or {}).items():
+        if part in LAYOUT_FILES:
+            refresh_dataset_files.append(
+                mount_file(
+                    app,
+                    f"/data/{spec['file']}",
+                    "application/octet-stream",
+                    served_path,
+                    lambda path, part=part: data_source.write_parquet(path, part),
+                    eager=load_files,
+                )
+            )
+
+    clear_neighbors_bytes = mount_bytes(
         app,
-        "/data/dataset.parquet",
+        f"/data/{NEIGHBORS_SIDECAR}",
         "application/octet-stream",
-        lambda: to_parquet_bytes(data_source.dataset),
+        lambda: data_source.neighbors.to_bytes() if data_source.neighbors else b"",
     )
 
+    @app.post("/data/neighbors")
+    async def post_neighbors(request: Request):
+        # Batched lookup: {"ids": [...]} -> {"neighbors": [{"ids", "distances"}, ...]}
+        if data_source.neighbors is None:
+            return Response(status_code=404)
+        ids = (await request.json())["ids"]
+        try:
+            return {"neighbors": data_source.neighbors.lookup(ids)}
+        except (IndexError, TypeError) as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+    @app.get("/data/projection/status")
+    async def get_projection_status():
+        if data_source.projection_status is None:
+            return Response(status_code=404)
+        return data_source.projection_status
+
     @app.get("/data/metadata.json")
     async def get_metadata():
         if duckdb_uri is None or duckdb_uri == "wasm":
@@ -80,36 +152,130 @@ def make_server(
         data = data_source.make_archive(static_path)
         return Response(content=data, media_type="application/zip")
 
+    # Query results, kept across restarts if there is a directory (opened
+    # with the database, see open_connection).
+    query_cache = None
+    if query_cache_bytes > 0:
+        query_cache = QueryCache(query_cache_bytes)
+
     # Database connection
 
-    @lru_cache(maxsize=1)
-    def get_connection():
-        con = duckdb.connect(":memory:")
+    # In server mode, queries run on the database, which is opened at startup.
+    # With a database file, the file then holds the only copy of the dataset,
+    # in a table that queries do not change (see open_database). Otherwise the
+    # database is only used to export selections, and opened on first use.
+    server_mode = duckdb_uri == "server"
+    connection_lock = threading.Lock()
+    connection: concurrent.futures.Future[duckdb.DuckDBPyConnection] | None = None
+
+    def load_dataset():
+        with get_connection().cursor() as cursor:
+            return cursor.sql(f"SELECT * FROM {BASE_TABLE}").df()
+
+    def open_connection():
         df = data_source.dataset
-        _ = df
-        con.sql("CREATE TABLE dataset AS (SELECT * FROM df)")
+        if not server_mode:
+            return open_database(df, None)
+        # The fingerprint is one pass over the dataset, done once for both.
+        fingerprint = None
+        if duckdb_path is not None or (
+            query_cache is not None and query_cache_directory is not None
+        ):
+            fingerprint = dataset_fingerprint(df)
+        con = open_database(df, duckdb_path, fingerprint)
+        if query_cache is not None and query_cache_directory is not None:
+            assert fingerprint is not None
+            query_cache.open_directory(query_cache_directory, fingerprint)
+        if table_columns(con, BASE_TABLE) is not None:
+            data_source.release_dataset(df, load_dataset)
         return con
 
+    def connection_future() -> concurrent.futures.Future[duckdb.DuckDBPyConnection]:
+        nonlocal connection
+        with connection_lock:
+            if connection is None:
+                connection = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1
+                ).submit(open_connection)
+            return connection
+
+    def get_connection() -> duckdb.DuckDBPyConnection:
+        return connection_future().result()
+
+    if server_mode:
+        connection_future()
+
+    def on_dataset_update():
+        for refresh in refresh_dataset_files:
+            refresh()
+        clear_neighbors_bytes()
+        if connection is None:
+            return
+        df = data_source.dataset
+        fingerprint = dataset_fingerprint(df)
+        # Replace the table in one statement, so concurrent queries see either
+        # the old or the new table.
+        with get_connection().cursor() as cursor:
+            cursor.register("new_dataset", df)
+            has_base = table_columns(cursor, BASE_TABLE) is not None
+            if has_base:
+                cursor.execute(
+                    f"CREATE OR REPLACE TABLE {BASE_TABLE} AS (SELECT * FROM new_dataset)"
+                )
+            cursor.execute("CREATE OR REPLACE TABLE dataset AS (SELECT * FROM new_dataset)")
+            cursor.unregister("new_dataset")
+            if has_base:
+                set_database_fingerprint(cursor, fingerprint)
+        if query_cache is not None:
+            query_cache.invalidate(fingerprint)
+        if has_base:
+            data_source.release_dataset(df, load_dataset)
+
+    data_source.add_listener(on_dataset_update)
+
+    @app.get("/data/query/cache")
+    async def get_query_cache():
+        if query_cache is None:
+            return Response(status_code=404)
+        return query_cache.stats()
+
+    content_types = {"arrow": "application/octet-stream", "json": "application/json"}
+
     def handle_query(query: dict):
         sql = query["sql"]
         command = query["type"]
-        with get_connection().cursor() as cursor:
+        # The persisted results are available once the database is open.
+        con = get_connection()
+        key = None
+        if query_cache is not None and command in content_types:
+            key = QueryCache.key(command, sql)
+            cached = query_cache.get(key)
+            if cached is not None:
+                return Response(cached, headers={"Content-Type": content_types[command]})
+        with con.cursor() as cursor:
+            generation = None if query_cache is None else query_cache.generation
             try:
                 result = cursor.execute(sql)
                 if command == "exec":
                     return JSONResponse({})
                 elif command == "arrow":
                     buf = arrow_to_bytes(result.arrow())
-                    return Response(
-                        buf, headers={"Content-Type": "application/octet-stream"}
-                    )
                 elif command == "json":
-                    data = result.df().to_json(orient="records")
-                    return Response(data, headers={"Content-Type": "application/json"})
+                    buf = result.df().to_json(orient="records").encode("utf-8")
                 else:
                     raise ValueError(f"Unknown command {command}")
+                if key is not None:
+                    assert query_cache is not None and generation is not None
+                    query_cache.put(key, buf, query_identifiers(sql), generation)
+                return Response(buf, headers={"Content-Type": content_types[command]})
             except Exception as e:
                 return JSONResponse({"error": str(e)}, status_code=500)
+            finally:
+                if query_cache is not None and command == "exec":
+                    scope = mutation_scope(sql)
+                    if scope and has_dependents(cursor):
+                        scope = None
+                    query_cache.invalidate_scope(scope)
 
     def handle_selection(query: dict):
         predicate = query.get("predicate", None)
@@ -173,10 +339,524 @@ def make_server(
     return app
 
 
+# Strings and quoted identifiers, or runs of whitespace (outside of them).
+_sql_tokens = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+# Strings, quoted identifiers, identifiers, and the * of "SELECT *" (or "t.*"),
+# as opposed to the one of count(*) or a product.
+_sql_names = re.compile(
+    r"""('(?:[^']|'')*')|"((?:[^"]|"")*)"|(?:\bSELECT|\bDISTINCT|,|\.)\s*(\*)|([A-Za-z_][A-Za-z0-9_$]*)""",
+    re.IGNORECASE,
+)
+
+# The name that stands for all columns, in the identifiers of a query.
+ALL_COLUMNS = "*"
+
+# Statements that only create an object if it is missing, such as Mosaic's
+# pre-aggregated tables, which cannot change the result of a query that ran.
+_create_if_not_exists = re.compile(
+    r"^\s*CREATE\s+(?:(?:TEMP|TEMPORARY)\s+)?(?:TABLE|VIEW|SCHEMA|SEQUENCE)\s+IF\s+NOT\s+EXISTS\b",
+    re.IGNORECASE,
+)
+
+# A table name, optionally qualified by the schema and catalog.
+_table_name = r"""(?P<table>(?:"(?:[^"]|"")*"|[\w$]+)(?:\s*\.\s*(?:"(?:[^"]|"")*"|[\w$]+))*)"""
+
+# ALTER TABLE and UPDATE, followed by the table name.
+_alter_table = re.compile(
+    r"^\s*ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?" + _table_name, re.IGNORECASE
+)
+_rename_table = re.compile(r"\s*RENAME\s+TO\b", re.IGNORECASE)
+_update = re.compile(r"^\s*UPDATE\s+" + _table_name, re.IGNORECASE)
+
+# Strings, quoted identifiers, words, and single characters other than spaces.
+_sql_parts = re.compile(r"""'(?:[^']|'')*'|"((?:[^"]|"")*)"|(\w+)|(\S)""")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapses whitespace outside of strings and quoted identifiers, and
+    drops a trailing semicolon, so that formatting does not change cache keys."""
+    sql = _sql_tokens.sub(lambda m: m.group(1) or " ", sql).strip()
+    return sql.removesuffix(";").rstrip()
+
+
+def query_identifiers(sql: str) -> set[str]:
+    """The identifiers (lowercase, as DuckDB is case insensitive) that the SQL
+    mentions, with ALL_COLUMNS if it selects all columns. Keywords and function
+    names are included too, which only makes invalidation broader."""
+    names = set()
+    for m in _sql_names.finditer(sql):
+        if m.group(2) is not None:
+            names.add(m.group(2).replace('""', '"').lower())
+        elif m.group(3) is not None:
+            names.add(ALL_COLUMNS)
+        elif m.group(4) is not None:
+            names.add(m.group(4).lower())
+    return names
+
+
+def _updated_columns(sql: str) -> set[str] | None:
+    """The columns that the SET clause of an UPDATE (after the table name)
+    assigns, or None if they are not listed one by one."""
+    columns = set()
+    depth = 0
+    in_set = False
+    expect_column = False
+    for m in _sql_parts.finditer(sql):
+        quoted, word, char = m.groups()
+        if expect_column and quoted is None and word is None:
+            return None
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth > 0:
+            continue
+        elif word is not None and word.upper() == "SET" and not in_set:
+            in_set = expect_column = True
+        elif word is not None and word.upper() in ("FROM", "WHERE", "RETURNING"):
+            break
+        elif char == ",":
+            expect_column = in_set
+        elif expect_column and (quoted is not None or word is not None):
+            name = quoted.replace('""', '"') if quoted is not None else word
+            columns.add(name.lower())
+            expect_column = False
+    return columns or None
+
+
+def _unqualified_name(name: str) -> str:
+    """The last part of a (qualified) table name, lowercase."""
+    parts = [m.group(1) or m.group(2) for m in _sql_parts.finditer(name)]
+    return [part for part in parts if part is not None][-1].replace('""', '"').lower()
+
+
+def mutation_scope(sql: str) -> dict[str, set[str]] | None:
+    """What executing the statements can change, for the query cache: the
+    changed columns by table (with ALL_COLUMNS, as the columns of "SELECT *"
+    change too), empty if nothing changes, or None if anything could change.
+
+    Statements that change nothing are queries and CREATE ... IF NOT EXISTS.
+    Columns are changed by ALTER TABLE (e.g., ADD COLUMN, as the viewer does
+    to color points) and by UPDATE."""
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error:
+        return None
+    scope: dict[str, set[str]] = {}
+    for statement in statements:
+        query = statement.query
+        kind = statement.type
+        if kind == duckdb.StatementType.SELECT:
+            continue
+        if kind == duckdb.StatementType.CREATE and _create_if_not_exists.match(query):
+            continue
+        if (
+            kind == duckdb.StatementType.ALTER
+            and (m := _alter_table.match(query))
+            and not _rename_table.match(query, m.end())
+        ):
+            # All the names after the table name.
+            columns = query_identifiers(query[m.end() :]) | {ALL_COLUMNS}
+            scope.setdefault(_unqualified_name(m.group("table")), set()).update(columns)
+            continue
+        if kind == duckdb.StatementType.UPDATE and (m := _update.match(query)):
+            columns = _updated_columns(query[m.end() :])
+            if columns is None:
+                return None
+            columns.add(ALL_COLUMNS)
+            scope.setdefault(_unqualified_name(m.group("table")), set()).update(columns)
+            continue
+        return None
+    return scope
+
+
+def has_dependents(cursor: duckdb.DuckDBPyConnection) -> bool:
+    """Whether the database has views or macros, through which a query can
+    read tables and columns that it does not name."""
+    (count,) = cursor.execute(
+        "SELECT (SELECT count(*) FROM duckdb_views() WHERE NOT internal)"
+        " + (SELECT count(*) FROM duckdb_functions() WHERE NOT internal"
+        " AND function_type IN ('macro', 'table_macro'))"
+    ).fetchone()  # type: ignore
+    return count > 0
+
+
+class QueryCache:
+    """A cache of query results (Arrow IPC or JSON bytes), keyed by the command
+    and the normalized SQL. The least recently used results are evicted beyond
+    the memory budget.
+
+    With a directory (see open_directory), results are also written there and
+    read back after a restart. The cache cannot tell when the data changes on
+    its own: `invalidate` must be called when the dataset changes, and
+    `invalidate_scope` when a query changes the database.
+
+    Each result is stored with the identifiers of its query, so that a change
+    to some columns only drops the results that mention them. Results that
+    mention columns changed by queries are not written to the directory, as
+    such changes do not outlast the session (the viewer makes them again)."""
+
+    # The budget of the directory, in bytes.
+    max_disk_bytes = 1024 * 1024 * 1024
+
+    # The file format: the length of a JSON list of the identifiers (uint32),
+    # the list, and the result.
+    _file_header = struct.Struct("<I")
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.directory: Path | None = None
+        # Incremented on invalidation, so results computed before are not stored.
+        self.generation = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[bytes, frozenset[str]]] = OrderedDict()
+        self._bytes = 0
+        # File name -> (size, identifiers), least recently used first.
+        self._files: OrderedDict[str, tuple[int, frozenset[str]]] = OrderedDict()
+        self._disk_bytes = 0
+        # Identifiers of the columns changed by queries in this session.
+        self._changed: set[str] = set()
+
+    @staticmethod
+    def key(command: str, sql: str) -> str:
+        text = command + "\n" + normalize_sql(sql)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def open_directory(self, directory: Path, version: str):
+        """Keeps results in the directory, for the data identified by `version`.
+        Results of another version are removed."""
+        with self._lock:
+            self.directory = directory
+            self._reset_directory(version)
+
+    def _reset_directory(self, version: str):
+        assert self.directory is not None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        version_path = self.directory / "version"
+        current = version_path.read_text() if version_path.exists() else None
+        files = sorted(
+            self.directory.glob("*.bin"), key=lambda path: path.stat().st_mtime_ns
+        )
+        self._files.clear()
+        self._disk_bytes = 0
+        for path in files:
+            identifiers = None
+            if current == version:
+                try:
+                    with open(path, "rb") as f:
+                        identifiers = self._read_identifiers(f)
+                except (OSError, ValueError, struct.error):
+                    pass
+            if identifiers is None:
+                path.unlink(missing_ok=True)
+            else:
+                size = path.stat().st_size
+                self._files[path.name] = (size, identifiers)
+                self._disk_bytes += size
+        if current != version:
+            version_path.write_text(version)
+
+    def _read_identifiers(self, f) -> frozenset[str]:
+        (length,) = self._file_header.unpack(f.read(self._file_header.size))
+        return frozenset(json.loads(f.read(length)))
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            name = key + ".bin"
+            if self.directory is not None and name in self._files:
+                try:
+                    path = self.directory / name
+                    with open(path, "rb") as f:
+                        identifiers = self._read_identifiers(f)
+                        value = f.read()
+                    os.utime(path)
+                    self._files.move_to_end(name)
+                    self._insert(key, value, identifiers)
+                    self.disk_hits += 1
+                    return value
+                except (OSError, ValueError, struct.error):
+                    self._disk_bytes -= self._files.pop(name)[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: bytes, identifiers: set[str], generation: int):
+        """Stores a result, with the identifiers of its query (see
+        query_identifiers), unless the cache was invalidated since `generation`."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            identifiers = frozenset(identifiers)
+            self._insert(key, value, identifiers)
+            name = key + ".bin"
+            if (
+                self.directory is not None
+                and name not in self._files
+                and len(value) <= self.max_disk_bytes
+                and identifiers.isdisjoint(self._changed)
+            ):
+                path = self.directory / name
+                tmp_path = path.with_name(f"{name}.{os.getpid()}.tmp")
+                header = json.dumps(sorted(identifiers)).encode("utf-8")
+                try:
+                    with open(tmp_path, "wb") as f:
+                        f.write(self._file_header.pack(len(header)))
+                        f.write(header)
+                        f.write(value)
+                    os.replace(tmp_path, path)
+                except OSError as e:
+                    logger.warning("Cannot write to the query cache: %s", e)
+                    return
+                size = path.stat().st_size
+                self._files[name] = (size, identifiers)
+                self._disk_bytes += size
+                while self._disk_bytes > self.max_disk_bytes:
+                    old, (old_size, _) = self._files.popitem(last=False)
+                    (self.directory / old).unlink(missing_ok=True)
+                    self._disk_bytes -= old_size
+
+    def _insert(self, key: str, value: bytes, identifiers: frozenset[str]):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key)[0])
+        self._entries[key] = (value, identifiers)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, (old, _) = self._entries.popitem(last=False)
+            self._bytes -= len(old)
+            self.evictions += 1
+
+    def invalidate(self, version: str):
+        """Drops all results, after the dataset changed. `version` identifies
+        the new data for the directory."""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._changed.clear()
+            if self.directory is not None:
+                (self.directory / "version").unlink(missing_ok=True)
+                self._reset_directory(version)
+
+    def invalidate_scope(self, scope: dict[str, set[str]] | None):
+        """Drops the results that a query may have changed, given by its
+        mutation_scope: those that mention a changed table and one of its
+        changed columns. If the scope is None (any change), all results are
+        dropped and the directory is not used for the rest of the session.
+
+        Results are matched by the names in their SQL, so a scope must only be
+        given if no view or macro can read the tables (see has_dependents)."""
+        if scope is not None and len(scope) == 0:
+            return
+
+        def affected(identifiers: frozenset[str]) -> bool:
+            assert scope is not None
+            return any(
+                table in identifiers and not identifiers.isdisjoint(columns)
+                for table, columns in scope.items()
+            )
+
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            if scope is None:
+                self._entries.clear()
+                self._bytes = 0
+                if self.directory is not None:
+                    for name in self._files:
+                        (self.directory / name).unlink(missing_ok=True)
+                    (self.directory / "version").unlink(missing_ok=True)
+                    self._files.clear()
+                    self._disk_bytes = 0
+                    self.directory = None
+                return
+            for columns in scope.values():
+                self._changed |= columns
+            for key, (value, identifiers) in list(self._entries.items()):
+                if affected(identifiers):
+                    del self._entries[key]
+                    self._bytes -= len(value)
+            if self.directory is not None:
+                for name, (size, identifiers) in list(self._files.items()):
+                    if affected(identifiers):
+                        del self._files[name]
+                        (self.directory / name).unlink(missing_ok=True)
+                        self._disk_bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_entries": len(self._files),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+# The table with the dataset as loaded, in a database file. Queries change the
+# "dataset" table (e.g., the viewer adds columns to it), but not this one.
+BASE_TABLE = "embedding_atlas_base"
+
+
+def dataset_fingerprint(df) -> str:
+    """A digest of the dataset's columns, types, and values, which tells
+    whether a stored copy is current."""
+    hasher = Hasher()
+    hasher.update(
+        {
+            "columns": [[str(name), str(df[name].dtype)] for name in df.columns],
+            "rows": len(df),
+        }
+    )
+    for name in df.columns:
+        hasher.update(_hashable_column(df[name]))
+    return hasher.hexdigest()
+
+
+def _hashable_column(values: pd.Series):
+    # An Arrow array hashed by buffer where possible (see Hasher), with
+    # dictionaries decoded and dates as integers.
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed types.
+        return values.astype(str).tolist()
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()  # type: ignore
+    if pa.types.is_temporal(array.type):
+        array = array.cast(pa.int64())
+    return array
+
+
+def table_columns(
+    con: duckdb.DuckDBPyConnection, table: str
+) -> list[tuple[str, str]] | None:
+    """The names and types of the table's columns, or None if there is no table."""
+    columns = con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns"
+        " WHERE table_schema = 'main' AND table_name = ? ORDER BY ordinal_position",
+        [table],
+    ).fetchall()
+    return [tuple(column) for column in columns] or None
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _restore_dataset_table(con: duckdb.DuckDBPyConnection):
+    # Undo the changes of previous sessions to the dataset table: columns
+    # added by queries are dropped, and other changes to the schema or the
+    # row count rebuild the table from the base table.
+    base = table_columns(con, BASE_TABLE)
+    assert base is not None
+    current = table_columns(con, "dataset")
+    if current is not None and current[: len(base)] == base:
+        [(base_rows,)] = con.execute(f"SELECT count(*) FROM {BASE_TABLE}").fetchall()
+        [(rows,)] = con.execute("SELECT count(*) FROM dataset").fetchall()
+        if rows == base_rows:
+            for name, _ in current[len(base) :]:
+                con.execute(f"ALTER TABLE dataset DROP COLUMN {_quote(name)}")
+            return
+    logger.info("Restoring the dataset table")
+    con.execute(f"CREATE OR REPLACE TABLE dataset AS (SELECT * FROM {BASE_TABLE})")
+
+
+def set_database_fingerprint(con: duckdb.DuckDBPyConnection, fingerprint: str):
+    con.execute(
+        "CREATE OR REPLACE TABLE embedding_atlas_info AS (SELECT ? AS fingerprint)",
+        [fingerprint],
+    )
+
+
+def get_database_fingerprint(con: duckdb.DuckDBPyConnection) -> str | None:
+    try:
+        row = con.execute("SELECT fingerprint FROM embedding_atlas_info").fetchone()
+    except duckdb.CatalogException:
+        return None
+    return None if row is None else row[0]
+
+
+def open_database(
+    df, path: Path | None, fingerprint: str | None = None
+) -> duckdb.DuckDBPyConnection:
+    """Opens a DuckDB database with the dataset as the "dataset" table.
+
+    With a path, the database file also has the dataset in BASE_TABLE, which
+    queries do not change. The file is reused if it holds the same dataset
+    (see dataset_fingerprint), with the dataset table restored from the base
+    table, and otherwise built again. It is built under another name and then
+    renamed, so an interrupted build is never reused. If the file is in use by
+    another process, the database is in memory instead. `fingerprint` is the
+    dataset's, if already computed."""
+    if path is None:
+        con = duckdb.connect(":memory:")
+        con.sql("CREATE TABLE dataset AS (SELECT * FROM df)")
+        return con
+
+    if fingerprint is None:
+        fingerprint = dataset_fingerprint(df)
+    if path.exists():
+        try:
+            con = duckdb.connect(str(path))
+        except duckdb.IOException as e:
+            logger.warning("Cannot open %s (%s), using an in-memory database", path, e)
+            return open_database(df, None)
+        if (
+            get_database_fingerprint(con) == fingerprint
+            and table_columns(con, BASE_TABLE) is not None
+        ):
+            logger.info("Opened the database %s", path)
+            _restore_dataset_table(con)
+            return con
+        con.close()
+
+    logger.info("Building the database %s...", path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    with duckdb.connect(str(tmp_path)) as con:
+        con.sql(f"CREATE TABLE {BASE_TABLE} AS (SELECT * FROM df)")
+        con.sql(f"CREATE TABLE dataset AS (SELECT * FROM {BASE_TABLE})")
+        set_database_fingerprint(con, fingerprint)
+        con.execute("CHECKPOINT")
+    try:
+        os.replace(tmp_path, path)
+        Path(f"{path}.wal").unlink(missing_ok=True)
+    except OSError as e:
+        # Another process has the file open.
+        logger.warning("Cannot replace %s (%s), using %s", path, e, tmp_path)
+        return duckdb.connect(str(tmp_path))
+    return duckdb.connect(str(path))
+
+
 def arrow_to_bytes(arrow):
     sink = pa.BufferOutputStream()
     with pa.ipc.new_stream(sink, arrow.schema) as writer:
-        writer.write(arrow)
+        if isinstance(arrow, pa.RecordBatchReader):
+            # Newer versions of DuckDB return results as a reader.
+            for batch in arrow:
+                writer.write_batch(batch)
+        else:
+            writer.write(arrow)
     return sink.getvalue().to_pybytes()
 
 
@@ -192,9 +872,109 @@ def parse_range_header(request: Request, content_length: int):
     return None
 
 
+def mount_file(
+    app: FastAPI,
+    url: str,
+    media_type: str,
+    directory: Path,
+    write: Callable[[Path], None],
+    eager: bool = True,
+) -> Callable[[], None]:
+    """Serves a file at the url from disk, with range and conditional requests
+    (ranges are handled by FileResponse, as of Starlette 0.39).
+    The file is written by `write` in a background thread, and again after
+    each call of the returned function; requests wait for the latest file to be
+    written. If `eager`, it is written right away, and otherwise on the first
+    request for it."""
+    stem, suffix = os.path.splitext(url.rsplit("/", 1)[-1])
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    generations = itertools.count()
+    lock = threading.Lock()
+    files: list[Path] = []
+    current: concurrent.futures.Future[Path] | None = None
+
+    def make(path: Path) -> Path:
+        tmp_path = path.with_name(path.name + ".tmp")
+        write(tmp_path)
+        os.replace(tmp_path, path)
+        with lock:
+            files.append(path)
+            # Keep the previous file for requests that are still sending it.
+            while len(files) > 2:
+                files.pop(0).unlink(missing_ok=True)
+        return path
+
+    def start() -> concurrent.futures.Future[Path]:
+        nonlocal current
+        # Each version gets its own name, so a file is never replaced while served.
+        name = f"{stem}-{os.getpid()}-{next(generations)}{suffix}"
+        current = executor.submit(make, directory / name)
+        return current
+
+    def refresh():
+        nonlocal current
+        with lock:
+            if eager:
+                start()
+            else:
+                current = None
+
+    @atexit.register
+    def remove_files():
+        with lock:
+            for path in files:
+                path.unlink(missing_ok=True)
+
+    refresh()
+
+    @app.api_route(url, methods=["GET", "HEAD"])
+    async def get(request: Request):
+        with lock:
+            future = current if current is not None else start()
+        path = await asyncio.wrap_future(future)
+        response = FileResponse(
+            path,
+            media_type=media_type,
+            headers={"Cache-Control": "no-cache"},
+            stat_result=os.stat(path),
+        )
+        if is_not_modified(request, response):
+            return Response(
+                status_code=304,
+                headers={
+                    k: response.headers[k]
+                    for k in ["etag", "last-modified", "cache-control"]
+                },
+            )
+        return response
+
+    return refresh
+
+
+def is_not_modified(request: Request, response: Response) -> bool:
+    """Whether the client's copy, as given by If-None-Match or
+    If-Modified-Since, is still current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = response.headers["etag"].removeprefix("W/")
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            last_modified = parsedate_to_datetime(response.headers["last-modified"])
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 def mount_bytes(
     app: FastAPI, url: str, media_type: str, make_content: Callable[[], bytes]
-):
+) -> Callable[[], None]:
+    """Serves the content at the url, with range requests. The content is made
+    on first use; returns a function that clears it so it is made again."""
+
     @lru_cache(maxsize=1)
     def get_content() -> bytes:
         return make_content()
@@ -233,3 +1013,5 @@ def mount_bytes(
                 media_type=media_type,
                 status_code=206,
             )
+
+    return get_content.cache_clear
@@ -3,6 +3,7 @@
 import hashlib
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 from typing import Any
@@ -10,6 +11,8 @@ from typing import Any
 import inquirer
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from platformdirs import user_cache_path
 
 logger = logging.getLogger()
@@ -66,7 +69,149 @@ def load_huggingface_data(filename: str, splits: list[str] | None) -> pd.DataFra
     return df
 
 
-def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+def file_fingerprint(url: str) -> dict | None:
+    """Returns a fingerprint that changes whenever the local file at url changes,
+    without reading the whole file. Returns None if url is not a local file."""
+    path = Path(url)
+    if not path.is_file():
+        return None
+    stat = path.stat()
+    fingerprint = {
+        "path": str(path.resolve()),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+    if path.suffix.lower() == ".parquet":
+        # The footer includes the row group layout and column statistics.
+        metadata = pq.read_metadata(path)
+        fingerprint["parquet"] = json.dumps(
+            metadata.to_dict(), sort_keys=True, default=str
+        )
+    return fingerprint
+
+
+def _without_nested_arrow_dtypes(table: pa.Table) -> pa.Table:
+    # pandas records Arrow-backed columns with their type name, which it cannot
+    # parse back for nested types (e.g., the neighbors structs), so reading the
+    # file with pandas would fail. Record them as object columns instead.
+    metadata = table.schema.metadata or {}
+    if b"pandas" not in metadata:
+        return table
+    pandas_metadata = json.loads(metadata[b"pandas"])
+    for column in pandas_metadata["columns"]:
+        numpy_type = column.get("numpy_type") or ""
+        if numpy_type.endswith("[pyarrow]") and "<" in numpy_type:
+            column["numpy_type"] = "object"
+    return table.replace_schema_metadata(
+        {**metadata, b"pandas": json.dumps(pandas_metadata).encode("utf-8")}
+    )
+
+
+# Row groups are sized to about this many bytes of (uncompressed) data, within
+# the row count bounds below. Small row groups let readers that filter on a
+# column, such as DuckDB-WASM filtering the viewport of the embedding view,
+# skip more of the file, at the cost of more metadata.
+PARQUET_ROW_GROUP_BYTES = 2 * 1024 * 1024
+PARQUET_ROW_GROUP_MIN_ROWS = 4096
+PARQUET_ROW_GROUP_MAX_ROWS = 32768
+
+
+def hilbert_order(x: np.ndarray, y: np.ndarray, bits: int = 16) -> np.ndarray:
+    """Returns the order of the points (x, y) along a Hilbert curve over their
+    bounding box, on a grid of 2^bits x 2^bits cells. Points that are close in
+    the plane tend to be close in this order. Points with NaN coordinates come
+    last, in their original order."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = 1 << bits
+
+    def quantize(values: np.ndarray) -> np.ndarray:
+        result = np.zeros(len(values), dtype=np.int64)
+        if valid.any():
+            low, high = values[valid].min(), values[valid].max()
+            if high > low:
+                scaled = (values[valid] - low) / (high - low) * n
+                result[valid] = np.clip(scaled, 0, n - 1).astype(np.int64)
+        return result
+
+    qx, qy = quantize(x), quantize(y)
+    index = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (qx & s) > 0
+        ry = (qy & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so that the curve inside it is in standard position.
+        flip = ~ry & rx
+        qx = np.where(flip, n - 1 - qx, qx)
+        qy = np.where(flip, n - 1 - qy, qy)
+        qx, qy = np.where(~ry, qy, qx), np.where(~ry, qx, qy)
+        s >>= 1
+    index[~valid] = n * n
+    return np.argsort(index, kind="stable")
+
+
+def write_parquet(
+    df: pd.DataFrame,
+    where,
+    sort_by: tuple[str, str] | None = None,
+    columns: list[str] | None = None,
+    sample: int | None = None,
+):
+    """Writes the DataFrame as parquet to a path or file object.
+
+    The file is compressed with zstd, with min/max statistics for each column
+    chunk, dictionary encoding for string columns, and row groups sized by
+    PARQUET_ROW_GROUP_BYTES. If `sort_by` names two coordinate columns, the
+    rows are written in Hilbert curve order of these coordinates (see
+    hilbert_order), so each row group covers a compact region of the plane
+    and readers can prune row groups by their statistics. Row ids stored in
+    a column are not affected by the order.
+
+    Only the given `columns` are written, if any; the order of the rows is
+    the same for any columns. With `sample`, at most this many rows are
+    written, evenly spaced in the order of the rows, which with `sort_by` is
+    a spatially stratified sample."""
+    order = None
+    if sort_by is not None:
+        x, y = sort_by
+        order = hilbert_order(df[x].to_numpy(), df[y].to_numpy())
+    if sample is not None and sample < len(df):
+        if order is None:
+            order = np.arange(len(df))
+        order = order[np.linspace(0, len(df) - 1, sample).astype(np.int64)]
+    table = pa.Table.from_pandas(df if columns is None else df[columns])
+    if order is not None:
+        table = table.take(order)
+    row_bytes = table.nbytes / max(table.num_rows, 1)
+    row_group_size = int(
+        np.clip(
+            PARQUET_ROW_GROUP_BYTES / max(row_bytes, 1),
+            PARQUET_ROW_GROUP_MIN_ROWS,
+            PARQUET_ROW_GROUP_MAX_ROWS,
+        )
+    )
+    dictionary_columns = [
+        field.name
+        for field in table.schema
+        if pa.types.is_string(field.type)
+        or pa.types.is_large_string(field.type)
+        or pa.types.is_dictionary(field.type)
+    ]
+    pq.write_table(
+        _without_nested_arrow_dtypes(table),
+        where,
+        row_group_size=row_group_size,
+        compression="zstd",
+        use_dictionary=dictionary_columns,
+        write_statistics=True,
+    )
+
+
+def to_parquet_bytes(
+    df: pd.DataFrame, sort_by: tuple[str, str] | None = None
+) -> bytes:
     class NoCloseBytesIO(BytesIO):
         def close(self):
             pass
@@ -75,7 +220,7 @@ def to_parquet_bytes(df: pd.DataFrame) -> bytes:
             super().close()
 
     bytes_io = NoCloseBytesIO()
-    df.to_parquet(bytes_io)
+    write_parquet(df, bytes_io, sort_by=sort_by)
     result = bytes_io.getvalue()
     bytes_io.actually_close()
     return result
@@ -90,24 +235,131 @@ def cache_path(*subfolders: str, mkdir=True) -> Path:
     return p
 
 
+# xxhash is optional, it speeds up hashing of large buffers.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def _chunk_digest(data: memoryview) -> bytes:
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.sha256(data).digest()
+
+
 class Hasher:
+    # Buffers larger than this are split into chunks that are hashed in parallel.
+    chunk_size = 16 * 1024 * 1024
+
+    # Lists with at least this many items are hashed as Arrow arrays.
+    bulk_threshold = 1024
+
     def __init__(self):
         self.hash = hashlib.sha256()
         self.counter = 0
 
-    def _emit(self, type: bytes, data: bytes):
+    def _emit(self, type: bytes, data: bytes | memoryview):
         self.hash.update(type + b"{")
         self.hash.update(data)
         self.hash.update(b"}")
 
+    def _emit_buffer(self, type: bytes, data: memoryview):
+        if data.nbytes <= self.chunk_size:
+            self._emit(type, data)
+            return
+        # The digest of a large buffer is the digest of its chunk digests.
+        chunks = [
+            data[i : i + self.chunk_size] for i in range(0, data.nbytes, self.chunk_size)
+        ]
+        with ThreadPoolExecutor() as executor:
+            digests = list(executor.map(_chunk_digest, chunks))
+        algorithm = b"xxh3" if xxhash is not None else b"sha256"
+        self._emit(type + b":chunks:" + algorithm, b"".join(digests))
+
+    def _emit_ndarray(self, value: np.ndarray):
+        if value.dtype.hasobject:
+            self._emit_value(value.tolist())
+            return
+        value = np.ascontiguousarray(value)
+        self._emit(b"np.dtype", value.dtype.str.encode("utf-8"))
+        self._emit(b"np.shape", json.dumps(value.shape).encode("utf-8"))
+        self._emit_buffer(b"np.ndarray", memoryview(value.reshape(-1).view(np.uint8)))
+
+    def _emit_arrow(self, array: pa.Array):
+        self.hash.update(b"arrow{")
+        self._emit(b"type", str(array.type).encode("utf-8"))
+        self._emit(b"length", str(len(array)).encode("utf-8"))
+        nulls = np.flatnonzero(array.is_null().to_numpy(zero_copy_only=False))
+        self._emit_ndarray(nulls.astype(np.int64))
+        type = array.type
+        if (
+            pa.types.is_string(type)
+            or pa.types.is_binary(type)
+            or pa.types.is_large_string(type)
+            or pa.types.is_large_binary(type)
+        ):
+            # Hash the offsets (rebased to zero) and the referenced data only,
+            # so that slices of larger arrays hash the same as fresh arrays.
+            offset_type = (
+                np.int64
+                if pa.types.is_large_string(type) or pa.types.is_large_binary(type)
+                else np.int32
+            )
+            offsets = np.frombuffer(
+                array.buffers()[1], dtype=offset_type  # type: ignore
+            )[array.offset : array.offset + len(array) + 1]
+            self._emit_ndarray((offsets - offsets[0]).astype(np.int64))
+            data = array.buffers()[2]
+            if data is not None:
+                self._emit_buffer(
+                    b"data", memoryview(data)[int(offsets[0]) : int(offsets[-1])]
+                )
+        elif pa.types.is_struct(type):
+            for field, child in zip(type, array.flatten()):  # type: ignore
+                self._emit(b"field", field.name.encode("utf-8"))
+                self._emit_arrow(child)
+        elif pa.types.is_integer(type) or pa.types.is_floating(type):
+            self._emit_ndarray(array.to_numpy(zero_copy_only=False))
+        else:
+            self._emit_value(array.to_pylist())
+        self.hash.update(b"}")
+
+    def _bulk_array(self, value: list) -> pa.Array | None:
+        """Converts a long list of strings, bytes or dicts to an Arrow array."""
+        if len(value) < self.bulk_threshold:
+            return None
+        try:
+            if all(isinstance(item, str) for item in value):
+                return pa.array(value, type=pa.large_string())
+            if all(isinstance(item, bytes) for item in value):
+                return pa.array(value, type=pa.large_binary())
+            if all(isinstance(item, dict) for item in value):
+                array = pa.array(value)
+                return array if pa.types.is_struct(array.type) else None
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        return None
+
     def _emit_value(self, value):
         if isinstance(value, bytes):
-            self._emit(b"bytes", value)
+            self._emit_buffer(b"bytes", memoryview(value))
         elif isinstance(value, str):
             self._emit(b"str", value.encode("utf-8"))
         elif isinstance(value, np.ndarray):
-            self._emit(b"np.ndarray", value.tobytes())
+            self._emit_ndarray(value)
+        elif isinstance(value, pa.ChunkedArray):
+            self.hash.update(b"pa.ChunkedArray{")
+            for chunk in value.chunks:
+                self._emit_arrow(chunk)
+            self.hash.update(b"}")
+        elif isinstance(value, pa.Array):
+            self._emit_arrow(value)
         elif isinstance(value, list):
+            array = self._bulk_array(value)
+            if array is not None:
+                self._emit_arrow(array)
+                return
             self.hash.update(b"list{")
             for item in value:
                 self._emit_value(item)
@@ -0,0 +1,28 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+import numpy as np
+import pandas as pd
+
+from embedding_atlas.knn import exact_nearest_neighbors
+from embedding_atlas.projection import _append_to_layout, neighbors_column
+
+
+def test_append_updates_neighbors_like_a_full_recompute():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1100, 16)).astype(np.float32)
+    old_vectors, new_vectors = vectors[:1000], vectors[1000:]
+    indices, distances = exact_nearest_neighbors(old_vectors, 15, "cosine")
+    old_neighbors = pd.Series(neighbors_column(indices, distances))
+    layout = rng.standard_normal((1000, 2))
+
+    _, updated, (new_indices, _) = _append_to_layout(
+        old_vectors, new_vectors, layout, old_neighbors, {"random_state": 0}
+    )
+
+    expected, _ = exact_nearest_neighbors(vectors, 15, "cosine")
+    for row in range(1000):
+        value = updated.get(row, old_neighbors.iloc[row])
+        assert set(np.asarray(value["ids"])) == set(expected[row]), row
+    np.testing.assert_array_equal(
+        np.sort(new_indices, axis=1), np.sort(expected[1000:], axis=1)
+    )
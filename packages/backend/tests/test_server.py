@@ -0,0 +1,49 @@
+# Copyright (c) 2025 Apple Inc. Licensed under MIT License.
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from embedding_atlas.data_source import DataSource
+from embedding_atlas.server import make_server
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+def make_client(tmp_path) -> TestClient:
+    data_frame = pd.DataFrame({"id": range(4), "c": ["a", "a", "b", "c"]})
+    data_source = DataSource("test", data_frame, {"columns": {"id_column": "id"}})
+    app = make_server(
+        data_source, str(tmp_path), duckdb_uri="server", query_cache_bytes=1 << 20
+    )
+    return TestClient(app)
+
+
+def query(client: TestClient, command: str, sql: str):
+    response = client.post("/data/query", json={"type": command, "sql": sql})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_query_cache_drops_results_read_through_a_view(tmp_path):
+    client = make_client(tmp_path)
+    query(client, "exec", "CREATE VIEW v AS SELECT c AS k FROM dataset")
+    sql = "SELECT k, count(*) AS n FROM v GROUP BY k ORDER BY k"
+    assert [row["k"] for row in query(client, "json", sql)] == ["a", "b", "c"]
+
+    query(client, "exec", "UPDATE dataset SET c = 'zzz'")
+    assert query(client, "json", sql) == [{"k": "zzz", "n": 4}]
+
+
+def test_query_cache_keeps_results_of_other_columns(tmp_path):
+    client = make_client(tmp_path)
+    sql = "SELECT count(*) AS n FROM dataset WHERE id > 0"
+    assert query(client, "json", sql) == [{"n": 3}]
+
+    query(client, "exec", "ALTER TABLE dataset ADD COLUMN IF NOT EXISTS d INTEGER")
+    query(client, "exec", "UPDATE dataset SET d = 1")
+    assert query(client, "json", sql) == [{"n": 3}]
+    assert client.get("/data/query/cache").json()["hits"] == 1
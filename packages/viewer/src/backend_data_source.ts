@@ -4,6 +4,7 @@ import type { Coordinator } from "@uwdata/mosaic-core";
 import * as SQL from "@uwdata/mosaic-sql";
 
 import type { DataColumns, DataSource } from "./data_source.js";
+import type { Searcher } from "./lib/api.js";
 import { initializeDatabase } from "./lib/database_utils.js";
 import { exportMosaicSelection, filenameForSelection, type ExportFormat } from "./lib/mosaic_exporter.js";
 import { downloadBuffer } from "./lib/utils.js";
@@ -30,12 +31,57 @@ interface Metadata {
     load?: boolean;
   };
   pointSize?: number;
+  neighbors?: {
+    sidecar: string;
+  };
+  /** The dataset split into files that are loaded in turn (see DataSource.layout in the backend) */
+  layout?: {
+    columns: string[];
+    preview?: { file: string; rows: number };
+    hot: { file: string; columns: string[] };
+    cold?: { file: string; columns: string[] };
+  };
+}
+
+type Layout = NonNullable<Metadata["layout"]>;
+
+/** A nearest neighbor graph in CSR form, as written by the backend (see neighbors.py) */
+interface NeighborGraph {
+  indptr: BigInt64Array;
+  ids: Int32Array;
+  distances: Float32Array;
+}
+
+function parseNeighborGraph(buffer: ArrayBuffer): NeighborGraph {
+  let view = new DataView(buffer);
+  let magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 8));
+  if (magic != "EANEIGHB" || view.getUint32(8, true) != 1) {
+    throw new Error("invalid neighbor graph file");
+  }
+  let count = Number(view.getBigUint64(16, true));
+  let nnz = Number(view.getBigUint64(24, true));
+  let offset = 32;
+  let indptr = new BigInt64Array(buffer, offset, count + 1);
+  offset += indptr.byteLength;
+  let ids = new Int32Array(buffer, offset, nnz);
+  offset += ids.byteLength;
+  let distances = new Float32Array(buffer, offset, nnz);
+  return { indptr, ids, distances };
 }
 
 export class BackendDataSource implements DataSource {
   private serverUrl: string;
   downloadArchive: (() => Promise<void>) | undefined = undefined;
   downloadSelection: ((predicate: string | null, format: ExportFormat) => Promise<void>) | undefined = undefined;
+  searcher: Searcher | undefined = undefined;
+  loadRemaining:
+    | ((
+        coordinator: Coordinator,
+        table: string,
+        onStatus: (message: string) => void,
+        onUpdate: () => void,
+      ) => Promise<void>)
+    | undefined = undefined;
 
   constructor(serverUrl: string) {
     if (serverUrl.startsWith("http")) {
@@ -58,7 +104,9 @@ export class BackendDataSource implements DataSource {
     let dbType = metadata.database?.type ?? "wasm";
     await initializeDatabase(coordinator, dbType, metadata.database?.uri ?? joinUrl(this.serverUrl, "query"));
 
-    if (metadata.database?.load) {
+    if (metadata.database?.load && metadata.layout != null) {
+      await this.loadLayout(coordinator, table, metadata.layout, onStatus);
+    } else if (metadata.database?.load) {
       onStatus("Loading data...");
       let datasetUrl = joinUrl(this.serverUrl, "dataset.parquet");
       await coordinator.exec(`
@@ -91,12 +139,113 @@ export class BackendDataSource implements DataSource {
       };
     }
 
+    if (metadata.neighbors != null) {
+      this.searcher = {
+        nearestNeighbors: this.neighborsSearcher(metadata.neighbors.sidecar, metadata.is_static ?? false),
+      };
+    }
+
     return {
       ...metadata.columns,
       pointSize: metadata.pointSize,
     };
   }
 
+  /** Loads the preview (or else the hot columns) first, and sets `loadRemaining` to load the rest.
+   * The files have their rows in the same order, so the columns are joined by position.
+   * Columns that are not loaded yet are NULL. */
+  private async loadLayout(
+    coordinator: Coordinator,
+    table: string,
+    layout: Layout,
+    onStatus: (message: string) => void,
+  ) {
+    let url = (file: string) => SQL.literal(joinUrl(this.serverUrl, file));
+    let list = (columns: string[]) => columns.map((c) => SQL.column(c).toString()).join(", ");
+    let allColumns = list(layout.columns);
+    let placeholders =
+      layout.cold != null ? `POSITIONAL JOIN (SELECT * FROM read_parquet(${url(layout.cold.file)}) LIMIT 0)` : "";
+
+    let loadHot = async () => {
+      await coordinator.exec(`
+        CREATE OR REPLACE TABLE ${table} AS (
+          SELECT ${allColumns} FROM read_parquet(${url(layout.hot.file)}) ${placeholders}
+        );
+      `);
+    };
+
+    let steps: { status: string; run: () => Promise<void> }[] = [];
+    if (layout.preview != null) {
+      onStatus("Loading preview...");
+      await coordinator.exec(`
+        CREATE OR REPLACE TABLE ${table} AS (
+          SELECT ${allColumns} FROM read_parquet(${url(layout.preview.file)}) ${placeholders}
+        );
+      `);
+      steps.push({ status: "Loading all points...", run: loadHot });
+    } else {
+      onStatus("Loading data...");
+      await loadHot();
+    }
+    if (layout.cold != null) {
+      let cold = layout.cold;
+      steps.push({
+        status: "Loading remaining columns...",
+        run: async () => {
+          await coordinator.exec(`
+            CREATE OR REPLACE TABLE ${table} AS (
+              SELECT ${allColumns}
+              FROM (SELECT ${list(layout.hot.columns)} FROM ${table})
+              POSITIONAL JOIN read_parquet(${url(cold.file)})
+            );
+          `);
+        },
+      });
+    }
+    if (steps.length > 0) {
+      this.loadRemaining = async (_coordinator, _table, onStatus, onUpdate) => {
+        for (let step of steps) {
+          onStatus(step.status);
+          await step.run();
+          onUpdate();
+        }
+      };
+    }
+  }
+
+  private neighborsSearcher(sidecar: string, isStatic: boolean) {
+    let lookup: (id: number) => Promise<{ ids: ArrayLike<number>; distances: ArrayLike<number> }>;
+    if (isStatic) {
+      // Fetch the whole graph on first use.
+      let graph: Promise<NeighborGraph> | null = null;
+      lookup = async (id) => {
+        if (graph == null) {
+          graph = this.fetchEndpoint(sidecar)
+            .then((x) => x.arrayBuffer())
+            .then(parseNeighborGraph);
+        }
+        let { indptr, ids, distances } = await graph;
+        let start = Number(indptr[id]);
+        let end = Number(indptr[id + 1]);
+        return { ids: ids.subarray(start, end), distances: distances.subarray(start, end) };
+      };
+    } else {
+      lookup = async (id) => {
+        let resp = await this.fetchEndpoint("neighbors", {
+          method: "POST",
+          body: JSON.stringify({ ids: [id] }),
+        });
+        return (await resp.json()).neighbors[0];
+      };
+    }
+    return async (id: any) => {
+      let { ids, distances } = await lookup(Number(id));
+      return Array.from(ids)
+        .map((nid, i) => ({ id: nid, distance: distances[i] }))
+        .filter((x) => x.id != id);
+    };
+  }
+
   private async fetchEndpoint(endpoint: string, init?: RequestInit) {
     let resp = await fetch(joinUrl(this.serverUrl, endpoint), init);
     if (resp.status != 200) {
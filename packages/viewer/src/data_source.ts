@@ -1,6 +1,7 @@
 // Copyright (c) 2025 Apple Inc. Licensed under MIT License.
 
 import { type Coordinator } from "@uwdata/mosaic-core";
+import type { Searcher } from "./lib/api.js";
 import type { ExportFormat } from "./lib/mosaic_exporter.js";
 
 /** A key-value cache */
@@ -41,6 +42,15 @@ export interface DataSource {
     onStatus: (message: string) => void,
   ): Promise<DataColumns>;
 
+  /** Loads the rest of the dataset, if `initializeCoordinator` only loaded part of it (e.g., a preview sample).
+   * The table is replaced in one or more steps, and `onUpdate` is called after each. */
+  loadRemaining?: (
+    coordinator: Coordinator,
+    table: string,
+    onStatus: (message: string) => void,
+    onUpdate: () => void,
+  ) => Promise<void>;
+
   /** Downloads a zip archive of the dataset plus static assets of the viewer */
   downloadArchive?: () => Promise<void>;
 
@@ -49,4 +59,7 @@ export interface DataSource {
 
   /** A cache suitable for this data source */
   cache?: Cache;
+
+  /** Search functions provided by the data source, such as nearest neighbors served apart from the dataset */
+  searcher?: Searcher;
 }